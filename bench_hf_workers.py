@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_hf_workers.py
+-------------------
+比較不同「worker 數 x 每個 worker 的執行緒數」下 HF 後端的吞吐量（segments/s）。
+
+使用範例：
+  python bench_hf_workers.py --splits 1x64,4x16,8x8,16x4 --segments 256
+  python bench_hf_workers.py --pdf paper.pdf --no-ocr --splits 1x8,2x4,4x2
+"""
+from __future__ import annotations
+
+import argparse
+import time
+from typing import List, Tuple
+
+from translate_paper import (
+    HFTranslator,
+    ShardedHFTranslator,
+    TranslateConfig,
+    extract_paragraphs_from_pdf,
+    split_for_translation,
+)
+
+SAMPLE = (
+    "We study the fair allocation of indivisible goods among agents with additive valuations. "
+    "An allocation is envy-free up to one good if no agent prefers another bundle after removing a single item."
+)
+
+
+def parse_splits(spec: str) -> List[Tuple[int, int]]:
+    splits = []
+    for part in spec.split(","):
+        w, t = part.lower().split("x")
+        splits.append((int(w), int(t)))
+    return splits
+
+
+def main():
+    ap = argparse.ArgumentParser(description="HF 多行程推論吞吐量測試")
+    ap.add_argument("--hf-model", default=None, help="HF 模型名（預設同 translate_paper.py）")
+    ap.add_argument("--splits", default="1x8,2x4,4x2,8x1", help="以逗號分隔的 <workers>x<threads>")
+    ap.add_argument("--segments", type=int, default=128, help="合成段落數（未指定 --pdf 時）")
+    ap.add_argument("--pdf", default=None, help="改用這份 PDF 的段落")
+    ap.add_argument("--no-ocr", action="store_true", help="讀 --pdf 時不走 OCR")
+    args = ap.parse_args()
+
+    cfg = TranslateConfig(backend="hf", hf_model=args.hf_model)
+    if args.pdf:
+        texts = split_for_translation(extract_paragraphs_from_pdf(args.pdf, use_ocr=not args.no_ocr), max_chars=600)
+    else:
+        texts = [f"{SAMPLE} ({i})" for i in range(args.segments)]
+
+    print(f"{'workers':>7} {'threads':>7} {'segments':>8} {'seconds':>8} {'seg/s':>8}")
+    for workers, threads in parse_splits(args.splits):
+        if workers == 1:
+            import torch
+            torch.set_num_threads(threads)
+            backend = HFTranslator(model_name=args.hf_model)
+        else:
+            backend = ShardedHFTranslator(args.hf_model, workers=workers, threads=threads)
+        # 暖機：載入模型、啟動 worker，不列入計時；分片後端要等每個 worker 都載好模型，
+        # 否則沒拿到暖機片段的 worker 會在計時區間內才載入
+        if isinstance(backend, ShardedHFTranslator):
+            backend.warm_up()
+        backend.translate_list(texts[:max(workers, 1)], cfg)
+        start = time.perf_counter()
+        backend.translate_list(texts, cfg)
+        elapsed = time.perf_counter() - start
+        if isinstance(backend, ShardedHFTranslator):
+            backend.close()
+        print(f"{workers:>7} {threads:>7} {len(texts):>8} {elapsed:>8.2f} {len(texts) / elapsed:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
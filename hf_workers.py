@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+hf_workers.py
+-------------
+多行程 HF 推論（給多核心機器用）：
+- 每個 worker 行程各自載入模型，torch 執行緒數依「核心數 / worker 數」設定
+- 權重先匯出成一份 safetensors，worker 以 mmap 直接建立 tensor，
+  N 個行程共用同一份 page cache，RAM 不會隨 worker 數成倍增加
+- worker 的模型骨架建在 meta device 上（不配置、不初始化隨機權重），啟動快、峰值 RAM 也不會是 N 份模型
+- 片段（shard）經由 multiprocessing.Pool 的共用工作佇列分派，結果依原順序返回
+"""
+from __future__ import annotations
+
+import atexit
+import json
+import mmap
+import multiprocessing as mp
+import os
+import struct
+import tempfile
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+WEIGHTS_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "arxiv-reader", "weights")
+
+# safetensors header 的 dtype 名稱 -> torch dtype 屬性名
+_SAFETENSORS_DTYPES = {
+    "F64": "float64", "F32": "float32", "F16": "float16", "BF16": "bfloat16",
+    "I64": "int64", "I32": "int32", "I16": "int16", "I8": "int8", "U8": "uint8", "BOOL": "bool",
+}
+
+
+def default_split(workers: Optional[int]=None, threads: Optional[int]=None) -> Tuple[int, int]:
+    """
+    決定 worker 數與每個 worker 的 torch 執行緒數。
+    torch 的 intra-op 執行緒超過 4~8 條後效益遞減，所以預設每個 worker 4 條。
+    """
+    cores = os.cpu_count() or 1
+    if workers is None:
+        workers = max(1, cores // (threads or 4))
+    if threads is None:
+        threads = max(1, cores // workers)
+    return workers, threads
+
+
+def shared_weights_path(model_name: str) -> str:
+    return os.path.join(WEIGHTS_CACHE_DIR, model_name.replace("/", "__") + ".safetensors")
+
+
+def shared_buffers_path(weights_path: str) -> str:
+    """不在 state_dict 裡的 buffer（如 M2M100 的 sinusoidal 位置編碼）另存一份，meta 骨架無法自己算出來。"""
+    return weights_path[:-len(".safetensors")] + ".buffers.safetensors"
+
+
+def _atomic_save(save, path: str):
+    # 每次匯出用唯一的暫存檔名：兩個行程同時匯出時不會寫進同一個檔，換名後的檔案一定完整
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    os.close(fd)
+    try:
+        save(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def prepare_shared_weights(model_name: str) -> str:
+    """第一次使用時在主行程載入模型並匯出 safetensors；之後直接沿用。"""
+    path = shared_weights_path(model_name)
+    buffers_path = shared_buffers_path(path)
+    if os.path.exists(path) and os.path.exists(buffers_path):
+        return path
+    from transformers import AutoModelForSeq2SeqLM
+    from safetensors.torch import save_file, save_model
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+    persistent = set(model.state_dict())
+    buffers = {n: b.contiguous() for n, b in model.named_buffers() if n not in persistent}
+    # 先寫 buffers 再寫權重：權重檔存在時 buffers 檔一定也在
+    _atomic_save(lambda tmp: save_file(buffers, tmp), buffers_path)
+    _atomic_save(lambda tmp: save_model(model, tmp), path)  # save_model 會處理共用（tied）權重
+    del model
+    return path
+def load_mmap_state_dict(path: str) -> Dict[str, Any]:
+    """
+    直接解析 safetensors 並以 torch.frombuffer 建立 tensor，不複製資料。
+    以 ACCESS_COPY（私有、寫入時複製）映射：推論只讀不寫，頁面會一直與其他行程共用。
+    """
+    import torch
+
+    with open(path, "rb") as f:
+        header_len = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_len))
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    base = 8 + header_len
+
+    state: Dict[str, Any] = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = getattr(torch, _SAFETENSORS_DTYPES[info["dtype"]])
+        start, end = info["data_offsets"]
+        itemsize = torch.empty((), dtype=dtype).element_size()
+        count = (end - start) // itemsize
+        if count == 0:
+            state[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        tensor = torch.frombuffer(mm, dtype=dtype, count=count, offset=base + start)
+        state[name] = tensor.reshape(info["shape"])
+    return state
+
+
+def load_shared_model(model_name: str, weights_path: str):
+    """
+    在 meta device 上建出模型骨架（只有形狀，不配置記憶體），
+    再把參數與 buffer 換成 mmap 上的 tensor（assign=True，不複製）。
+    """
+    import torch
+    from transformers import AutoConfig, AutoModelForSeq2SeqLM
+
+    config = AutoConfig.from_pretrained(model_name)
+    with torch.device("meta"):
+        model = AutoModelForSeq2SeqLM.from_config(config)
+    state = load_mmap_state_dict(weights_path)
+    # save_model 只存共用權重中的一份（例如 lm_head 與 embedding），其餘名稱要指回同一個 tensor；
+    # meta tensor 沒有 data_ptr，改以 keep_vars 取出的 Parameter 物件判斷是否共用
+    shared: Dict[int, List[str]] = {}
+    for name, tensor in model.state_dict(keep_vars=True).items():
+        shared.setdefault(id(tensor), []).append(name)
+    for names in shared.values():
+        present = [n for n in names if n in state]
+        if present:
+            for n in names:
+                state.setdefault(n, state[present[0]])
+    model.load_state_dict(state, strict=False, assign=True)
+
+    # 非 persistent buffer 不經過 load_state_dict，直接掛回所屬的子模組
+    buffers_path = shared_buffers_path(weights_path)
+    if os.path.exists(buffers_path):
+        for name, tensor in load_mmap_state_dict(buffers_path).items():
+            owner, _, attr = name.rpartition(".")
+            model.get_submodule(owner)._buffers[attr] = tensor
+
+    missing = [n for n, t in list(model.named_parameters()) + list(model.named_buffers()) if t.is_meta]
+    if missing:
+        raise RuntimeError(f"共用權重檔缺少這些 tensor（可刪除 {WEIGHTS_CACHE_DIR} 下的快取重新匯出）：{missing[:5]}")
+    model.eval()
+    return model
+
+
+# ---------------------------
+# worker 行程
+# ---------------------------
+
+_WORKER = None
+
+def _init_worker(factory: Callable, factory_kwargs: Dict[str, Any], threads: int, ready):
+    global _WORKER
+    import torch
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # 已經有平行工作跑過就不能再設，不影響正確性
+    _WORKER = factory(**factory_kwargs)
+    # 翻譯器大多延遲載入模型；在這裡先載好，第一個 shard 才不會混進載入時間
+    ensure_loaded = getattr(_WORKER, "_ensure_loaded", None)
+    if ensure_loaded is not None:
+        ensure_loaded()
+    ready.release()
+
+def _run_shard(job):
+    texts, cfg = job
+    before = dict(getattr(_WORKER, "decode_stats", {}))
+    out = _WORKER.translate_list(texts, cfg)
+    # 連同這個 shard 造成的統計變化一起送回主行程
+    after = getattr(_WORKER, "decode_stats", {})
+    return out, {k: v - before.get(k, 0) for k, v in after.items()}
+
+
+class ShardPool:
+    """
+    固定數量的 worker 行程；每個 worker 以 factory(**factory_kwargs) 建立自己的翻譯器。
+    用 spawn 而不是 fork：主行程若已初始化過 torch 執行緒池，fork 出來的子行程可能卡死。
+    """
+    def __init__(self, factory: Callable, factory_kwargs: Dict[str, Any], workers: int, threads: int):
+        self.workers = workers
+        self.threads = threads
+        self.stats: Dict[str, int] = {}  # 各 worker 翻譯器 decode_stats 的加總
+        ctx = mp.get_context("spawn")
+        self._ready = ctx.Semaphore(0)
+        self.pool = ctx.Pool(workers, initializer=_init_worker,
+                             initargs=(factory, factory_kwargs, threads, self._ready))
+        atexit.register(self.close)
+
+    def wait_ready(self):
+        """等所有 worker 都建好翻譯器並載入模型（例如 benchmark 開始計時前）。"""
+        for _ in range(self.workers):
+            self._ready.acquire()
+
+    def map(self, shards: List[List[str]], cfg) -> List[List[str]]:
+        # chunksize=1：每個 shard 各自排入佇列，先做完的 worker 先拿下一個，長短不一也不會卡住
+        results = []
+        for out, delta in self.pool.map(_run_shard, [(s, cfg) for s in shards], chunksize=1):
+            for k, v in delta.items():
+                self.stats[k] = self.stats.get(k, 0) + v
+            results.append(out)
+        return results
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
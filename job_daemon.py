@@ -0,0 +1,555 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+job_daemon.py
+-------------
+監看資料夾的翻譯工作佇列（取代 cron 每個檔案各跑一個 translate_paper.py、彼此不協調）：
+- 工作佇列存在 SQLite，daemon 重啟不會遺失或重複工作
+- 優先序：預設小檔優先，並隨等待時間提高（aging），大論文不會永遠排不到
+- 全域同時執行數上限 + 每個後端各自的同時執行數與速率預算（例如 openai 每小時最多啟動 20 個工作）
+  注意：--rate 限制的是「工作啟動數」，不是 API 請求數；一篇大論文本身就可能送出數百個請求，
+  要控制對供應商的請求速率，請同時用 --limit 限制該後端的同時工作數
+- status 子命令顯示各狀態工作數、執行中工作與吞吐量
+
+使用範例：
+  python job_daemon.py watch ~/Downloads/arxiv --out-dir ~/papers/zh --max-jobs 3 --limit openai=2 --rate openai=20/h
+  python job_daemon.py watch ~/Downloads/arxiv --out-dir ~/papers/zh -- --no-opencc   # -- 之後的參數原樣傳給 translate_paper.py
+  python job_daemon.py add paper.pdf --priority 0 --backend deepl
+  python job_daemon.py status
+"""
+from __future__ import annotations
+
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_DB = os.path.join(os.path.expanduser("~"), ".cache", "arxiv-reader", "jobs.sqlite")
+TRANSLATE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "translate_paper.py")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          INTEGER PRIMARY KEY,
+    pdf_path    TEXT NOT NULL,
+    pdf_sha256  TEXT NOT NULL,
+    size_bytes  INTEGER NOT NULL,
+    out_path    TEXT NOT NULL,
+    backend     TEXT NOT NULL,
+    extra_args  TEXT NOT NULL DEFAULT '[]',
+    priority    REAL NOT NULL,
+    status      TEXT NOT NULL DEFAULT 'queued',  -- queued | running | done | failed
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    pid         INTEGER,
+    created_at  REAL NOT NULL,
+    started_at  REAL,
+    finished_at REAL,
+    error       TEXT,
+    UNIQUE (pdf_sha256, backend, out_path)
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+"""
+
+
+def file_sha256(path: str, chunk_size: int=1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def parse_limits(specs: List[str]) -> Dict[str, int]:
+    """["openai=2", "deepl=1"] -> {"openai": 2, "deepl": 1}"""
+    out: Dict[str, int] = {}
+    for spec in specs:
+        name, n = spec.split("=", 1)
+        out[name.strip()] = int(n)
+    return out
+
+
+def parse_rates(specs: List[str]) -> Dict[str, Tuple[int, float]]:
+    """["openai=20/h"] -> {"openai": (20, 3600.0)}；單位 s / m / h。"""
+    units = {"s": 1.0, "m": 60.0, "h": 3600.0}
+    out: Dict[str, Tuple[int, float]] = {}
+    for spec in specs:
+        name, rate = spec.split("=", 1)
+        n, per = rate.split("/", 1)
+        if per not in units:
+            raise ValueError(f"速率單位需為 s / m / h：{spec}")
+        out[name.strip()] = (int(n), units[per])
+    return out
+
+
+def try_lock(path: str) -> Optional[int]:
+    """以 flock 取得獨占鎖，成功回傳 fd（關閉即釋放），已被持有時回傳 None。"""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+@dataclass
+class Job:
+    id: int
+    pdf_path: str
+    out_path: str
+    backend: str
+    extra_args: List[str]
+    attempts: int
+
+
+class JobQueue:
+    """
+    SQLite 上的持久化工作佇列。狀態轉換都在 transaction 內完成。
+    每個工作另有一個鎖檔：daemon 在標成 running 之前先 flock 取得，再把 fd 交給 run-job 與 translate_paper.py，
+    工作只要還有行程在跑，鎖就一直被持有。重啟時以「鎖是否還被持有」判斷工作是否仍在進行，
+    不依賴 pid（重開機後 pid 會被重用），行程結束或機器重開時鎖也會自動釋放。
+    """
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        # daemon 與各 run-job 行程同時寫入：WAL + busy timeout 避免 "database is locked"
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.lock_dir = path + ".locks"
+        os.makedirs(self.lock_dir, exist_ok=True)
+
+    def lock_path(self, job_id: int) -> str:
+        return os.path.join(self.lock_dir, f"job-{job_id}.lock")
+
+    def job_alive(self, job_id: int) -> bool:
+        fd = try_lock(self.lock_path(job_id))
+        if fd is None:
+            return True
+        os.close(fd)
+        return False
+
+    def add(self, pdf_path: str, out_path: str, backend: str, extra_args: List[str],
+            priority: Optional[float]=None) -> Optional[int]:
+        """同一份 PDF（以內容 hash 判斷）+ 後端 + 輸出檔只會排入一次；已存在時回傳 None。"""
+        size = os.path.getsize(pdf_path)
+        if priority is None:
+            priority = size / 1e6  # 預設：每 MB 一分，小檔先做
+        with self.conn:
+            cur = self.conn.execute(
+                "INSERT OR IGNORE INTO jobs (pdf_path, pdf_sha256, size_bytes, out_path, backend, extra_args, priority, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (os.path.abspath(pdf_path), file_sha256(pdf_path), size, os.path.abspath(out_path),
+                 backend, json.dumps(extra_args), priority, time.time()),
+            )
+        return cur.lastrowid if cur.rowcount else None
+
+    def known_paths(self) -> set:
+        return {r[0] for r in self.conn.execute("SELECT pdf_path FROM jobs")}
+
+    def recover(self, max_attempts: int) -> Tuple[int, int]:
+        """
+        處理 status 為 running、但執行者（run-job 行程）已不在的工作，例如 daemon 連同子行程被砍掉：
+        - 輸出檔已存在且是這次執行之後寫的：run-job 只在成功後才把暫存檔換名成輸出檔，所以視為完成
+          （輸出檔較舊時可能是其他後端寫到同一路徑的工作留下的，不能當成這個工作的結果）
+        - 否則重新排入佇列（或達到嘗試上限標為 failed）
+        執行者仍在跑的工作不動；run-job 結束時會自己更新狀態，daemon 重啟不會重複啟動它。
+        回傳 (完成數, 重排數)。
+        """
+        done = requeued = 0
+        rows = self.conn.execute(
+            "SELECT id, out_path, attempts, started_at FROM jobs WHERE status = 'running'"
+        ).fetchall()
+        with self.conn:
+            for job_id, out_path, attempts, started_at in rows:
+                if self.job_alive(job_id):
+                    continue
+                # os.replace 保留暫存檔的 mtime，這次執行寫出的輸出檔一定不早於 started_at
+                if os.path.exists(out_path) and os.path.getmtime(out_path) >= started_at:
+                    self.conn.execute("UPDATE jobs SET status = 'done', finished_at = ?, pid = NULL WHERE id = ?",
+                                      (time.time(), job_id))
+                    done += 1
+                else:
+                    status = "failed" if attempts >= max_attempts else "queued"
+                    self.conn.execute("UPDATE jobs SET status = ?, pid = NULL, error = ? WHERE id = ?",
+                                      (status, "執行中斷", job_id))
+                    requeued += 1
+        return done, requeued
+
+    def get(self, job_id: int) -> Optional[Job]:
+        r = self.conn.execute(
+            "SELECT id, pdf_path, out_path, backend, extra_args, attempts FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return Job(r[0], r[1], r[2], r[3], json.loads(r[4]), r[5]) if r else None
+
+    def status_of(self, job_id: int) -> Optional[str]:
+        row = self.conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def running(self) -> List[Tuple[int, str, Optional[int]]]:
+        return self.conn.execute("SELECT id, backend, pid FROM jobs WHERE status = 'running'").fetchall()
+
+    def started_since(self, backend: str, since: float) -> int:
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE backend = ? AND started_at >= ?", (backend, since)
+        ).fetchone()[0]
+
+    def next_jobs(self, aging_per_hour: float, limit: int=50) -> List[Job]:
+        """依「priority - 等待小時數 * aging」排序，數值越小越先做。"""
+        rows = self.conn.execute(
+            "SELECT id, pdf_path, out_path, backend, extra_args, attempts FROM jobs WHERE status = 'queued' "
+            "ORDER BY priority - (? - created_at) / 3600.0 * ? ASC, id ASC LIMIT ?",
+            (time.time(), aging_per_hour, limit),
+        ).fetchall()
+        return [Job(r[0], r[1], r[2], r[3], json.loads(r[4]), r[5]) for r in rows]
+
+    def mark_running(self, job_id: int, started_at: float):
+        """先標成 running 再啟動執行者，避免執行者很快結束時寫回的狀態被蓋掉。"""
+        with self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, attempts = attempts + 1, error = NULL WHERE id = ?",
+                (started_at, job_id),
+            )
+
+    def set_pid(self, job_id: int, pid: int):
+        with self.conn:
+            self.conn.execute("UPDATE jobs SET pid = ? WHERE id = ? AND status = 'running'", (pid, job_id))
+
+    def mark_finished(self, job_id: int, ok: bool, error: Optional[str], max_attempts: int):
+        with self.conn:
+            if ok:
+                status = "done"
+            else:
+                attempts = self.conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+                status = "failed" if attempts >= max_attempts else "queued"
+            self.conn.execute("UPDATE jobs SET status = ?, finished_at = ?, pid = NULL, error = ? WHERE id = ?",
+                              (status, time.time(), error, job_id))
+
+    def requeue(self, job_id: int, reason: str):
+        """daemon 自己停止時把工作放回佇列；不算一次失敗嘗試。"""
+        with self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET status = 'queued', pid = NULL, attempts = MAX(attempts - 1, 0), error = ? WHERE id = ?",
+                (reason, job_id),
+            )
+
+    def retry(self, job_id: int):
+        with self.conn:
+            self.conn.execute("UPDATE jobs SET status = 'queued', attempts = 0, error = NULL WHERE id = ?", (job_id,))
+
+    def close(self):
+        self.conn.close()
+
+
+# ---------------------------
+# 排程
+# ---------------------------
+
+class Scheduler:
+    def __init__(self, queue: JobQueue, out_dir: str, max_jobs: int, limits: Dict[str, int],
+                 rates: Dict[str, Tuple[int, float]], aging_per_hour: float, max_attempts: int):
+        self.queue = queue
+        self.out_dir = out_dir
+        self.max_jobs = max_jobs
+        self.limits = limits
+        self.rates = rates
+        self.aging_per_hour = aging_per_hour
+        self.max_attempts = max_attempts
+        self.procs: Dict[int, subprocess.Popen] = {}
+        self.stopping = False
+
+    def _allowed(self, backend: str, running_by_backend: Dict[str, int]) -> bool:
+        if running_by_backend.get(backend, 0) >= self.limits.get(backend, self.max_jobs):
+            return False
+        if backend in self.rates:
+            n, period = self.rates[backend]
+            if self.queue.started_since(backend, time.time() - period) >= n:
+                return False
+        return True
+
+    def reap(self):
+        for job_id, proc in list(self.procs.items()):
+            code = proc.poll()
+            if code is None:
+                continue
+            del self.procs[job_id]
+            # 正常情況 run-job 已自己寫回狀態；被信號砍掉等情況才由這裡補記失敗
+            if self.queue.status_of(job_id) == "running":
+                self.queue.mark_finished(job_id, False, f"run-job exit code {code}", self.max_attempts)
+            status = self.queue.status_of(job_id)
+            print(f"{'✅' if status == 'done' else '❌'} 工作 {job_id} 結束（{status}）")
+        # 上一個 daemon 留下的 run-job 行程結束後會自己更新狀態；這裡只處理執行者已消失的工作
+        self.queue.recover(self.max_attempts)
+
+    def schedule(self):
+        if self.stopping:
+            return
+        running = self.queue.running()
+        running_by_backend: Dict[str, int] = {}
+        for _, backend, _ in running:
+            running_by_backend[backend] = running_by_backend.get(backend, 0) + 1
+        slots = self.max_jobs - len(running)
+        if slots <= 0:
+            return
+        for job in self.queue.next_jobs(self.aging_per_hour):
+            if slots <= 0:
+                break
+            if not self._allowed(job.backend, running_by_backend):
+                continue
+            if not self._start(job):
+                continue
+            running_by_backend[job.backend] = running_by_backend.get(job.backend, 0) + 1
+            slots -= 1
+
+    def _start(self, job: Job) -> bool:
+        # 先取得工作鎖再標成 running：daemon 在任何時間點掛掉，鎖都會跟著釋放或已交給 run-job，
+        # 重啟時不會把仍在執行的工作重排；上一輪被終止的行程還沒完全結束時鎖取不到，這輪先跳過
+        fd = try_lock(self.queue.lock_path(job.id))
+        if fd is None:
+            return False
+        try:
+            log_dir = os.path.join(self.out_dir, "logs")
+            os.makedirs(log_dir, exist_ok=True)
+            cmd = [sys.executable, os.path.abspath(__file__), "--db", self.queue.path,
+                   "run-job", str(job.id), "--max-attempts", str(self.max_attempts), "--lock-fd", str(fd)]
+            self.queue.mark_running(job.id, time.time())
+            with open(os.path.join(log_dir, f"job-{job.id}.log"), "ab") as log:
+                # 獨立 session：終端機的 Ctrl-C 只會送到 daemon，由 shutdown() 決定如何停止子行程
+                proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, start_new_session=True,
+                                        pass_fds=(fd,))
+        finally:
+            os.close(fd)  # 子行程持有同一個 open file description，鎖不會因此釋放
+        self.queue.set_pid(job.id, proc.pid)
+        self.procs[job.id] = proc
+        print(f"▶ 工作 {job.id}（{job.backend}）：{os.path.basename(job.pdf_path)}")
+        return True
+
+    def shutdown(self):
+        """停止排程，終止自己啟動的工作（整個行程群組）並放回佇列，重啟後會從頭再跑這些工作。"""
+        self.stopping = True
+        for job_id, proc in list(self.procs.items()):
+            if proc.poll() is None:
+                os.killpg(proc.pid, signal.SIGTERM)
+                try:
+                    proc.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                    proc.wait()
+            if self.queue.status_of(job_id) == "running":
+                self.queue.requeue(job_id, "daemon 停止")
+        self.procs.clear()
+
+
+def partial_path(out_path: str, job_id: int) -> str:
+    """同資料夾下的暫存輸出檔，保留副檔名讓 translate_paper.py 選對寫入器。"""
+    folder, name = os.path.split(out_path)
+    stem, ext = os.path.splitext(name)
+    return os.path.join(folder, f".{stem}.job-{job_id}.partial{ext}")
+
+
+def run_job(queue: JobQueue, job_id: int, max_attempts: int, lock_fd: Optional[int]=None) -> int:
+    """
+    執行單一工作：translate_paper.py 寫到暫存檔，成功後才 os.replace 成正式輸出檔並寫回 done。
+    輸出檔存在 <=> 工作完成，daemon 重啟時據此判斷，不會把寫到一半的串流輸出當成完成。
+    lock_fd 為 daemon 交下來的工作鎖；手動執行時自行取得，取不到表示這個工作已在執行。
+    """
+    if lock_fd is None:
+        lock_fd = try_lock(queue.lock_path(job_id))
+        if lock_fd is None:
+            print(f"工作 {job_id} 已在執行中", file=sys.stderr)
+            return 2
+    job = queue.get(job_id)
+    if job is None:
+        print(f"找不到工作 {job_id}", file=sys.stderr)
+        return 2
+    tmp_path = partial_path(job.out_path, job.id)
+    cmd = [sys.executable, TRANSLATE_SCRIPT, job.pdf_path, "--out", tmp_path,
+           "--backend", job.backend, *job.extra_args]
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 第 {job.attempts} 次嘗試：{' '.join(cmd)}", flush=True)
+    # 鎖也交給 translate_paper.py：即使 run-job 本身被砍掉，翻譯還在跑時工作也不會被重排
+    code = subprocess.call(cmd, pass_fds=(lock_fd,))
+    ok = code == 0 and os.path.exists(tmp_path)
+    if ok:
+        os.replace(tmp_path, job.out_path)
+    elif os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    queue.mark_finished(job.id, ok, None if ok else f"translate_paper.py exit code {code}", max_attempts)
+    return code
+
+
+def scan_folder(queue: JobQueue, watch_dir: str, out_dir: str, out_ext: str, backend: str,
+                extra_args: List[str], pending_sizes: Dict[str, int]) -> int:
+    """
+    找出新的 PDF 並排入佇列。檔案大小需連續兩次掃描都相同才排入，避免抓到還在下載中的檔案。
+    """
+    known = queue.known_paths()
+    added = 0
+    for name in sorted(os.listdir(watch_dir)):
+        if not name.lower().endswith(".pdf"):
+            continue
+        path = os.path.abspath(os.path.join(watch_dir, name))
+        if path in known:
+            continue
+        # listdir 之後檔案可能被改名或刪除；只跳過這個檔案，不讓例外打斷 daemon 主迴圈
+        try:
+            size = os.path.getsize(path)
+            if pending_sizes.get(path) != size:
+                pending_sizes[path] = size
+                continue
+            del pending_sizes[path]
+            out_path = os.path.join(out_dir, os.path.splitext(name)[0] + out_ext)
+            job_id = queue.add(path, out_path, backend, extra_args)
+        except OSError as e:
+            pending_sizes.pop(path, None)
+            print(f"略過 {name}：{e}", file=sys.stderr)
+            continue
+        if job_id is not None:
+            added += 1
+            print(f"＋ 排入：{name}")
+    return added
+
+
+def cmd_watch(args, extra_args: List[str]):
+    os.makedirs(args.out_dir, exist_ok=True)
+    queue = JobQueue(args.db)
+    # 同一個佇列只允許一個 daemon 排程，否則兩邊都會啟動同一個 queued 工作
+    lock = open(args.db + ".lock", "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        print(f"已有 daemon 在使用 {args.db}", file=sys.stderr)
+        sys.exit(1)
+    done, requeued = queue.recover(args.max_attempts)
+    if done or requeued:
+        print(f"復原上次的工作：{done} 個已完成、{requeued} 個重新排入")
+    sched = Scheduler(queue, args.out_dir, args.max_jobs, parse_limits(args.limit), parse_rates(args.rate),
+                      args.aging, args.max_attempts)
+
+    def on_signal(signum, frame):
+        sched.stopping = True
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+
+    pending_sizes: Dict[str, int] = {}
+    print(f"監看 {args.watch_dir}（佇列：{args.db}）")
+    try:
+        while not sched.stopping:
+            scan_folder(queue, args.watch_dir, args.out_dir, args.ext, args.backend, extra_args, pending_sizes)
+            sched.reap()
+            sched.schedule()
+            time.sleep(args.interval)
+    finally:
+        sched.shutdown()
+        queue.close()
+        lock.close()
+        print("daemon 已停止；未完成的工作已放回佇列")
+
+
+def cmd_add(args, extra_args: List[str]):
+    queue = JobQueue(args.db)
+    out_path = args.out or os.path.splitext(args.pdf)[0] + ".zh.md"
+    job_id = queue.add(args.pdf, out_path, args.backend, extra_args, priority=args.priority)
+    print(f"已排入工作 {job_id}" if job_id is not None else "相同工作已在佇列中")
+    queue.close()
+
+
+def cmd_retry(args, extra_args: List[str]):
+    queue = JobQueue(args.db)
+    queue.retry(args.job_id)
+    print(f"工作 {args.job_id} 已重新排入")
+    queue.close()
+
+
+def cmd_run_job(args, extra_args: List[str]):
+    queue = JobQueue(args.db)
+    code = run_job(queue, args.job_id, args.max_attempts, args.lock_fd)
+    queue.close()
+    sys.exit(code)
+
+
+def cmd_status(args, extra_args: List[str]):
+    queue = JobQueue(args.db)
+    conn = queue.conn
+    counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+    print("狀態：" + "、".join(f"{s} {counts.get(s, 0)}" for s in ("queued", "running", "done", "failed")))
+
+    for job_id, pdf, backend, started in conn.execute(
+            "SELECT id, pdf_path, backend, started_at FROM jobs WHERE status = 'running' ORDER BY started_at"):
+        print(f"  執行中 #{job_id} [{backend}] {os.path.basename(pdf)}（{(time.time() - started) / 60:.1f} 分鐘）")
+    for job_id, pdf, error in conn.execute(
+            "SELECT id, pdf_path, error FROM jobs WHERE status = 'failed' ORDER BY finished_at DESC LIMIT 5"):
+        print(f"  失敗 #{job_id} {os.path.basename(pdf)}：{error}")
+
+    since = time.time() - args.window * 3600
+    print(f"最近 {args.window:g} 小時吞吐量：")
+    rows = conn.execute(
+        "SELECT backend, COUNT(*), SUM(size_bytes), AVG(finished_at - started_at), AVG(started_at - created_at) "
+        "FROM jobs WHERE status = 'done' AND finished_at >= ? GROUP BY backend", (since,)
+    ).fetchall()
+    if not rows:
+        print("  （沒有完成的工作）")
+    for backend, n, size, run_s, wait_s in rows:
+        print(f"  {backend}: {n / args.window:.2f} 工作/小時、{size / 1e6 / args.window:.1f} MB/小時、"
+              f"平均執行 {run_s / 60:.1f} 分鐘、平均等待 {wait_s / 60:.1f} 分鐘")
+    queue.close()
+
+
+def main():
+    argv = sys.argv[1:]
+    # -- 之後的參數原樣傳給 translate_paper.py
+    extra_args: List[str] = []
+    if "--" in argv:
+        i = argv.index("--")
+        argv, extra_args = argv[:i], argv[i + 1:]
+
+    ap = argparse.ArgumentParser(description="監看資料夾並以持久化佇列排程 PDF 翻譯工作。")
+    ap.add_argument("--db", default=DEFAULT_DB, help=f"工作佇列 SQLite 路徑（預設 {DEFAULT_DB}）")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    w = sub.add_parser("watch", help="以 daemon 模式監看資料夾")
+    w.add_argument("watch_dir", help="放入 PDF 的資料夾")
+    w.add_argument("--out-dir", required=True, help="輸出資料夾（另含 logs/）")
+    w.add_argument("--ext", choices=[".md", ".docx"], default=".md", help="輸出格式")
+    w.add_argument("--backend", default="hf", help="新工作使用的翻譯後端")
+    w.add_argument("--max-jobs", type=int, default=2, help="全域同時執行的工作數")
+    w.add_argument("--limit", action="append", default=[], help="每個後端的同時執行上限，例如 openai=2（可重複）")
+    w.add_argument("--rate", action="append", default=[], help="每個後端的工作啟動速率預算，例如 openai=20/h（可重複）；限制的是工作數而非 API 請求數")
+    w.add_argument("--aging", type=float, default=1.0, help="每等待一小時 priority 減少多少（預設 1.0，約等於 1 MB）")
+    w.add_argument("--max-attempts", type=int, default=3, help="失敗幾次後標為 failed")
+    w.add_argument("--interval", type=float, default=5.0, help="掃描/排程間隔秒數")
+    w.set_defaults(func=cmd_watch)
+
+    a = sub.add_parser("add", help="手動排入一個工作")
+    a.add_argument("pdf")
+    a.add_argument("--out", default=None, help="輸出檔（預設 <pdf>.zh.md）")
+    a.add_argument("--backend", default="hf")
+    a.add_argument("--priority", type=float, default=None, help="數值越小越先做（預設為檔案 MB 數）")
+    a.set_defaults(func=cmd_add)
+
+    r = sub.add_parser("retry", help="把失敗的工作重新排入")
+    r.add_argument("job_id", type=int)
+    r.set_defaults(func=cmd_retry)
+
+    j = sub.add_parser("run-job", help="（內部使用）執行單一工作，由 watch 啟動")
+    j.add_argument("job_id", type=int)
+    j.add_argument("--max-attempts", type=int, default=3)
+    j.add_argument("--lock-fd", type=int, default=None, help=argparse.SUPPRESS)
+    j.set_defaults(func=cmd_run_job)
+
+    s = sub.add_parser("status", help="顯示工作狀態與吞吐量")
+    s.add_argument("--window", type=float, default=24.0, help="吞吐量統計的時間窗（小時）")
+    s.set_defaults(func=cmd_status)
+
+    args = ap.parse_args(argv)
+    args.func(args, extra_args)
+
+
+if __name__ == "__main__":
+    main()
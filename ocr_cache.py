@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ocr_cache.py
+------------
+掃描型 PDF 的 OCR：
+- 逐頁轉圖、逐頁 OCR（不再一次把整份 PDF 以 300 DPI 轉成圖片放在記憶體）
+- 每頁結果快取在 ~/.cache/arxiv-reader/ocr/，key 為 PDF 內容 hash + 頁碼 + OCR 設定；
+  換後端或換 --tgt 重翻同一份掃描檔時不必再跑 tesseract
+- adaptive DPI：先以較低 DPI 辨識，tesseract 平均信心不足才提高 DPI 重做該頁
+  （需要逐字信心，所以改用 image_to_data 依 block/par 重組段落並附 bbox；
+  未開 adaptive 時維持 image_to_string + 空行分段，段落切分與先前相同）
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+OCR_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "arxiv-reader", "ocr")
+
+
+@dataclass
+class OCRConfig:
+    lang: str = "eng"
+    dpi: int = 300                 # 固定 DPI（adaptive 關閉時）與 adaptive 的最高 DPI
+    adaptive: bool = False
+    dpi_steps: Tuple[int, ...] = (150, 225, 300)  # adaptive 依序嘗試，不超過 dpi
+    min_confidence: float = 80.0   # tesseract 單字信心（0~100）平均低於此值就提高 DPI
+    cache_dir: Optional[str] = OCR_CACHE_DIR  # None 表示不使用快取
+
+    def cache_tag(self, engine_version: str) -> str:
+        """影響 OCR 結果的設定（不含快取位置）+ tesseract 版本 -> 短 hash。"""
+        settings = {k: v for k, v in asdict(self).items() if k != "cache_dir"}
+        settings["engine"] = engine_version
+        settings["format"] = 2  # 未開 adaptive 時改回空行分段，舊快取不沿用
+        return hashlib.sha1(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+@dataclass
+class OCRStats:
+    pages: int = 0
+    cache_hits: int = 0
+    seconds: float = 0.0           # 本次實際花在 OCR 的時間
+    saved_by_cache: float = 0.0    # 快取命中頁當初花的 OCR 時間
+    low_dpi_pages: int = 0         # adaptive：不需要最高 DPI 就完成的頁數
+    saved_by_adaptive: float = 0.0  # 依像素數（DPI 平方）估計的淨節省時間（已扣掉低 DPI 失敗重做的成本）
+    dpi_used: Dict[int, int] = field(default_factory=dict)
+
+    def report(self) -> str:
+        msg = (f"OCR：{self.pages} 頁，快取命中 {self.cache_hits} 頁（省下約 {self.saved_by_cache:.1f}s），"
+               f"實際 OCR {self.seconds:.1f}s")
+        if self.saved_by_adaptive or self.low_dpi_pages:
+            used = "、".join(f"{d} DPI {n} 頁" for d, n in sorted(self.dpi_used.items()))
+            msg += f"；adaptive DPI：{used}（估計淨省下約 {self.saved_by_adaptive:.1f}s）"
+        return msg
+
+
+def file_sha256(path: str, chunk_size: int=1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _paragraphs_from_data(data: Dict[str, list], dpi: int) -> Tuple[List[Tuple[str, Tuple[float, float, float, float]]], float]:
+    """
+    把 image_to_data 的逐字結果依 (block, par) 組回段落，行內以空白、行間以換行連接；
+    bbox 由像素換算成 PDF point（72 DPI），與 PyMuPDF 路徑的座標一致。
+    回傳 (段落列表, 單字平均信心)。
+    """
+    groups: Dict[Tuple[int, int], Dict[int, List[int]]] = {}
+    confs: List[float] = []
+    for i, word in enumerate(data["text"]):
+        if not word.strip():
+            continue
+        conf = float(data["conf"][i])
+        if conf >= 0:
+            confs.append(conf)
+        key = (data["block_num"][i], data["par_num"][i])
+        groups.setdefault(key, {}).setdefault(data["line_num"][i], []).append(i)
+
+    scale = 72.0 / dpi
+    paragraphs = []
+    for key in sorted(groups):
+        lines = groups[key]
+        idx = [i for ln in lines.values() for i in ln]
+        text = "\n".join(" ".join(data["text"][i] for i in lines[ln]) for ln in sorted(lines)).strip()
+        if not text:
+            continue
+        x0 = min(data["left"][i] for i in idx)
+        y0 = min(data["top"][i] for i in idx)
+        x1 = max(data["left"][i] + data["width"][i] for i in idx)
+        y1 = max(data["top"][i] + data["height"][i] for i in idx)
+        paragraphs.append((text, (x0 * scale, y0 * scale, x1 * scale, y1 * scale)))
+    mean_conf = sum(confs) / len(confs) if confs else 0.0
+    return paragraphs, mean_conf
+
+
+def _read_cache_entry(path: str) -> Optional[Tuple[float, List[Tuple[str, Optional[Tuple[float, float, float, float]]]]]]:
+    """回傳 (當初 OCR 秒數, 段落)；檔案不存在或內容損毀（例如寫到一半被中斷）都視為未命中。"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        paragraphs = [(p["text"], tuple(p["bbox"]) if p["bbox"] else None) for p in entry["paragraphs"]]
+        return float(entry["seconds"]), paragraphs
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"忽略損毀的 OCR 快取 {path}：{e}", file=sys.stderr)
+        return None
+
+
+def _write_cache_entry(path: str, entry: dict):
+    # 每次寫入用唯一的暫存檔名：多個行程（例如 daemon 同時以不同後端翻同一份掃描檔）不會互相覆寫，
+    # 換名後的快取檔一定完整
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def ocr_pdf_pages(pdf_path: str, opts: Optional[OCRConfig]=None,
+                  stats: Optional[OCRStats]=None) -> Iterator[Tuple[int, List[Tuple[str, Optional[Tuple[float, float, float, float]]]]]]:
+    """
+    逐頁產生 (頁碼, [(段落文字, bbox), ...])，頁碼從 1 起算；未開 adaptive 時 bbox 為 None。
+    """
+    try:
+        from pdf2image import convert_from_path, pdfinfo_from_path
+        import pytesseract
+    except Exception as e:
+        print("使用 --ocr 需要安裝 pdf2image 與 pytesseract，並且系統需安裝 tesseract。", file=sys.stderr)
+        raise
+
+    opts = opts or OCRConfig()
+    stats = stats if stats is not None else OCRStats()
+    page_count = int(pdfinfo_from_path(pdf_path)["Pages"])
+
+    cache_dir = None
+    if opts.cache_dir:
+        tag = opts.cache_tag(str(pytesseract.get_tesseract_version()))
+        cache_dir = os.path.join(opts.cache_dir, file_sha256(pdf_path)[:32], tag)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    if opts.adaptive:
+        dpis = [d for d in opts.dpi_steps if d < opts.dpi] + [opts.dpi]
+    else:
+        dpis = [opts.dpi]
+
+    for page_no in range(1, page_count + 1):
+        stats.pages += 1
+        cache_path = os.path.join(cache_dir, f"page-{page_no:05d}.json") if cache_dir else None
+        cached = _read_cache_entry(cache_path) if cache_path else None
+        if cached is not None:
+            seconds, paragraphs = cached
+            stats.cache_hits += 1
+            stats.saved_by_cache += seconds
+            yield page_no, paragraphs
+            continue
+
+        start = time.perf_counter()
+        for dpi in dpis:
+            t0 = time.perf_counter()
+            img = convert_from_path(pdf_path, dpi=dpi, first_page=page_no, last_page=page_no)[0]
+            if not opts.adaptive:
+                # 不需要信心分數：與先前相同，image_to_string 後以雙換行分段
+                raw = pytesseract.image_to_string(img, lang=opts.lang)
+                paragraphs = [(p.strip(), None) for p in re.split(r"\n\s*\n", raw) if p.strip()]
+                mean_conf = None
+                break
+            data = pytesseract.image_to_data(img, lang=opts.lang, output_type=pytesseract.Output.DICT)
+            paragraphs, mean_conf = _paragraphs_from_data(data, dpi)
+            # 空白頁沒有單字可評分，也不需要更高 DPI
+            if mean_conf >= opts.min_confidence or not paragraphs:
+                break
+        elapsed = time.perf_counter() - start
+        stats.seconds += elapsed
+        stats.dpi_used[dpi] = stats.dpi_used.get(dpi, 0) + 1
+        if opts.adaptive:
+            # OCR 時間大致與像素數（DPI 平方）成正比：以最後一輪的耗時推估直接用最高 DPI 的時間，
+            # 再扣掉這頁實際花的時間（含低 DPI 不合格而重做的部分）
+            last = time.perf_counter() - t0
+            stats.saved_by_adaptive += last * (opts.dpi / dpi) ** 2 - elapsed
+            if dpi < opts.dpi:
+                stats.low_dpi_pages += 1
+
+        if cache_path:
+            _write_cache_entry(cache_path, {
+                "dpi": dpi,
+                "mean_confidence": mean_conf,
+                "seconds": elapsed,
+                "paragraphs": [{"text": t, "bbox": list(b) if b else None} for t, b in paragraphs],
+            })
+        yield page_no, paragraphs
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+segment_index.py
+----------------
+譯文的段落索引（SQLite sidecar），把每個段落對回原始 PDF：
+- 原文、譯文、頁碼、bbox、cache key
+- 以 seg_id（主鍵）直接查詢單一段落
+- 可就地更新選定段落的譯文（重翻單段不必重跑整篇）
+- 不呼叫任何翻譯後端，就能從索引重新產生 .md / .docx
+- 論文改版（arXiv v2/v3）時，把新版段落對回舊索引，只重翻新增或改動的段落
+"""
+from __future__ import annotations
+
+import difflib
+import hashlib
+import json
+import re
+import sqlite3
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    seg_id      INTEGER PRIMARY KEY,
+    page        INTEGER NOT NULL,
+    bbox        TEXT,
+    source      TEXT NOT NULL,
+    translation TEXT NOT NULL DEFAULT '',
+    cache_key   TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS segments_staging (
+    seg_id      INTEGER PRIMARY KEY,
+    page        INTEGER NOT NULL,
+    bbox        TEXT,
+    source      TEXT NOT NULL,
+    translation TEXT NOT NULL DEFAULT '',
+    cache_key   TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+@dataclass
+class SegmentRecord:
+    seg_id: int
+    page: int
+    bbox: Optional[Tuple[float, float, float, float]]
+    source: str
+    translation: str = ""
+    cache_key: str = ""
+
+
+def make_cache_key(source: str, settings: str) -> str:
+    """同一段原文 + 同一組翻譯設定 -> 同一個 key；settings 由呼叫端把所有影響譯文的設定串成字串。"""
+    h = hashlib.sha1()
+    for part in (settings, source):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def parse_id_list(spec: str) -> List[int]:
+    """把 "3,7-9" 之類的字串轉成 [3, 7, 8, 9]。"""
+    ids: List[int] = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            ids.extend(range(int(lo), int(hi) + 1))
+        else:
+            ids.append(int(part))
+    return ids
+
+
+class SegmentIndex:
+    """
+    以 SQLite 存放段落紀錄；seg_id 為主鍵，單段查詢/更新不需要掃描整個檔案。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def _to_record(self, row) -> SegmentRecord:
+        seg_id, page, bbox, source, translation, cache_key = row
+        return SegmentRecord(
+            seg_id=seg_id,
+            page=page,
+            bbox=tuple(json.loads(bbox)) if bbox else None,
+            source=source,
+            translation=translation,
+            cache_key=cache_key,
+        )
+
+    def put_many(self, records: Iterable[SegmentRecord], staging: bool=False):
+        rows = (
+            (r.seg_id, r.page, json.dumps(list(r.bbox)) if r.bbox else None, r.source, r.translation, r.cache_key)
+            for r in records
+        )
+        table = "segments_staging" if staging else "segments"
+        with self.conn:
+            self.conn.executemany(f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM segments")
+
+    def begin_rebuild(self):
+        """
+        重建索引時新紀錄先寫進 segments_staging（put_many(..., staging=True)），
+        commit_rebuild 再一次換上；中途中斷時 segments 仍是完整的舊內容。
+        """
+        with self.conn:
+            self.conn.execute("DELETE FROM segments_staging")
+
+    def commit_rebuild(self, meta: Optional[Dict[str, str]]=None):
+        """在同一個 transaction 內以 staging 取代 segments（並更新 meta）。"""
+        with self.conn:
+            self.conn.execute("DELETE FROM segments")
+            self.conn.execute("INSERT INTO segments SELECT * FROM segments_staging")
+            self.conn.execute("DELETE FROM segments_staging")
+            if meta:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO meta VALUES (?, ?)", [(k, str(v)) for k, v in meta.items()]
+                )
+
+    def get(self, seg_id: int) -> Optional[SegmentRecord]:
+        row = self.conn.execute(
+            "SELECT seg_id, page, bbox, source, translation, cache_key FROM segments WHERE seg_id = ?",
+            (seg_id,),
+        ).fetchone()
+        return self._to_record(row) if row else None
+
+    def update_translation(self, seg_id: int, translation: str, cache_key: str):
+        with self.conn:
+            cur = self.conn.execute(
+                "UPDATE segments SET translation = ?, cache_key = ? WHERE seg_id = ?",
+                (translation, cache_key, seg_id),
+            )
+        if cur.rowcount == 0:
+            raise KeyError(f"索引中沒有段落 {seg_id}")
+
+    def __iter__(self) -> Iterator[SegmentRecord]:
+        # 以 cursor 逐筆讀取，不一次載入整個索引
+        cur = self.conn.execute(
+            "SELECT seg_id, page, bbox, source, translation, cache_key FROM segments ORDER BY seg_id"
+        )
+        for row in cur:
+            yield self._to_record(row)
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+
+    def set_meta(self, meta: Dict[str, str]):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?)", [(k, str(v)) for k, v in meta.items()]
+            )
+
+    def get_meta(self) -> Dict[str, str]:
+        return dict(self.conn.execute("SELECT key, value FROM meta").fetchall())
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+# ---------------------------
+# 改版比對：新版段落 <-> 舊索引
+# ---------------------------
+
+def normalize_source(text: str) -> str:
+    """忽略斷字、換行與大小寫差異，PDF 重新排版不會被當成內容改動。"""
+    text = re.sub(r"-\s*\n\s*", "", text)
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def source_hash(text: str) -> str:
+    return hashlib.sha1(normalize_source(text).encode("utf-8")).hexdigest()
+
+
+@dataclass
+class RevisionMatch:
+    record: Optional[SegmentRecord]  # 對到的舊段落（new 時為 None）
+    similarity: float
+    kind: str  # exact（內容未變，可沿用譯文） | changed（對到但需重翻） | new
+
+
+def match_previous(texts: List[str], prev_records: List[SegmentRecord],
+                   match_threshold: float=0.6, max_candidates: int=8) -> List[RevisionMatch]:
+    """
+    先以正規化後的內容 hash 做精確比對，剩下的段落再用 difflib 做模糊比對。
+    模糊比對只在「共享較多字詞」的前幾名舊段落上計算，不做全部兩兩比較。
+    每個舊段落最多被對到一次。
+    只有精確比對可沿用譯文：相似度再高也可能只差一個「not」或「at most / at least」，
+    模糊比對的結果一律標為 changed，只用來把新舊段落對齊。
+    """
+    matches: List[Optional[RevisionMatch]] = [None] * len(texts)
+    used = set()
+
+    by_hash: Dict[str, List[int]] = defaultdict(list)
+    for j, r in enumerate(prev_records):
+        by_hash[source_hash(r.source)].append(j)
+    for i, t in enumerate(texts):
+        bucket = by_hash.get(source_hash(t))
+        if bucket:
+            j = bucket.pop(0)
+            used.add(j)
+            matches[i] = RevisionMatch(prev_records[j], 1.0, "exact")
+
+    def tokens(text: str) -> set:
+        return {w for w in re.findall(r"\w+", text) if len(w) >= 4}
+
+    prev_norm = [normalize_source(r.source) for r in prev_records]
+    postings: Dict[str, List[int]] = defaultdict(list)
+    for j, norm in enumerate(prev_norm):
+        if j in used:
+            continue
+        for w in tokens(norm):
+            postings[w].append(j)
+
+    for i, t in enumerate(texts):
+        if matches[i] is not None:
+            continue
+        norm = normalize_source(t)
+        overlap: Counter = Counter()
+        for w in tokens(norm):
+            for j in postings.get(w, ()):
+                if j not in used:
+                    overlap[j] += 1
+        best_j, best_sim = -1, 0.0
+        for j, _ in overlap.most_common(max_candidates):
+            sm = difflib.SequenceMatcher(None, norm, prev_norm[j], autojunk=False)
+            if sm.real_quick_ratio() < max(match_threshold, best_sim) or sm.quick_ratio() < max(match_threshold, best_sim):
+                continue
+            sim = sm.ratio()
+            if sim > best_sim:
+                best_j, best_sim = j, sim
+        if best_j >= 0 and best_sim >= match_threshold:
+            used.add(best_j)
+            matches[i] = RevisionMatch(prev_records[best_j], best_sim, "changed")
+        else:
+            matches[i] = RevisionMatch(None, 0.0, "new")
+    return matches
@@ -19,6 +19,11 @@ translate_paper.py
   python translate_paper.py input.pdf --backend openai --openai-model gpt-4o-mini --out output.md
   python translate_paper.py input.pdf --backend deepl --out output.docx
   python translate_paper.py input.pdf --backend hf --hf-model facebook/m2m100_418M --src en --tgt zh-TW --out out.md
+  python translate_paper.py input.pdf --index paper.sqlite --bilingual --out out.md   # 對照輸出 + 段落索引
+  python translate_paper.py --index paper.sqlite --retranslate 12,30-32 --out out.md    # 只重翻指定段落
+  python translate_paper.py --index paper.sqlite --from-index --out out.docx           # 不呼叫後端，由索引重新產生
+  python translate_paper.py paper_v2.pdf --index v2.sqlite --prev-index v1.sqlite --out v2.md  # 改版只翻有變動的段落
+  python translate_paper.py input.pdf --glossary terms.tsv --tm ~/.cache/arxiv-reader/tm.sqlite --out out.md  # 術語表 + 翻譯記憶
 
 注意：
 - 本工具預設把簡體轉繁體（台灣用語），若你本來就要簡體，可加上 --no-opencc。
@@ -30,10 +35,18 @@ import argparse
 import re
 import os
 import sys
+import time
+import threading
+import dataclasses
 from dataclasses import dataclass
-from typing import List, Tuple, Dict, Optional
+from typing import List, Tuple, Dict, Optional, Iterable, Iterator
 import google.generativeai as genai
 
+from ocr_cache import OCR_CACHE_DIR, OCRConfig, OCRStats, file_sha256, ocr_pdf_pages
+from hf_workers import ShardPool, default_split, load_shared_model, prepare_shared_weights
+from translation_memory import Glossary, TranslationMemory
+from segment_index import SegmentIndex, SegmentRecord, make_cache_key, match_previous, parse_id_list
+
 # ---------------------------
 # 工具函式：偵測與處理數學式（mask/unmask）
 # ---------------------------
@@ -76,31 +89,48 @@ def unmask_math(text: str, mapping: Dict[str, str]) -> str:
         text = text.replace(key, mapping[key])
     return text
 
+_GLOSSARIES: Dict[str, Glossary] = {}
+
+def get_glossary(path: str) -> Glossary:
+    """同一份術語表在整個行程只讀取、編譯一次。"""
+    if path not in _GLOSSARIES:
+        _GLOSSARIES[path] = Glossary.load(path)
+    return _GLOSSARIES[path]
+
+def mask_for_translation(text: str, cfg: "TranslateConfig") -> Tuple[str, Dict[str, str]]:
+    """
+    mask_math + 術語表：術語 placeholder 的 mapping 值是指定譯名，
+    所以同一個 unmask_math 就能把數學式還原、把術語換成譯名。
+    """
+    masked, mapping = mask_math(text)
+    if cfg.glossary_path:
+        masked, terms = get_glossary(cfg.glossary_path).mask(masked)
+        mapping.update(terms)
+    return masked, mapping
+
 # ---------------------------
 # PDF 文字抽取
 # ---------------------------
 
-def extract_paragraphs_from_pdf(pdf_path: str, use_ocr: bool=True) -> List[str]:
+@dataclass
+class SourceSegment:
+    text: str
+    page: int  # 從 1 起算
+    bbox: Optional[Tuple[float, float, float, float]] = None  # OCR 路徑只有 --ocr-adaptive 時才有 bbox
+
+
+def extract_segments_from_pdf(pdf_path: str, use_ocr: bool=True, ocr: Optional[OCRConfig]=None) -> List[SourceSegment]:
     """
-    以 PyMuPDF 盡量依閱讀順序抽文字；若 use_ocr 啟用，會用 pdf2image + pytesseract。
-    回傳段落列表（空段落會被略過）。
+    以 PyMuPDF 盡量依閱讀順序抽文字；若 use_ocr 啟用，會逐頁以 pdf2image + pytesseract 辨識（結果有快取，見 ocr_cache.py）。
+    回傳段落列表（空段落會被略過），每段帶有頁碼與 bbox。
     """
-    paragraphs: List[str] = []
+    segments: List[SourceSegment] = []
     if use_ocr:
-        try:
-            from pdf2image import convert_from_path
-            import pytesseract
-        except Exception as e:
-            print("使用 --ocr 需要安裝 pdf2image 與 pytesseract，並且系統需安裝 tesseract。", file=sys.stderr)
-            raise
-
-        pages = convert_from_path(pdf_path, dpi=300)
-        for img in pages:
-            raw = pytesseract.image_to_string(img, lang="eng")
-            # 以雙換行分段
-            parts = re.split(r"\n\s*\n", raw)
-            paragraphs.extend([p.strip() for p in parts if p.strip()])
-        return paragraphs
+        stats = OCRStats()
+        for page_no, paragraphs in ocr_pdf_pages(pdf_path, ocr, stats):
+            segments.extend([SourceSegment(text, page_no, bbox) for text, bbox in paragraphs])
+        print(stats.report())
+        return segments
 
     # 非 OCR 路徑：PyMuPDF
     try:
@@ -110,7 +140,7 @@ def extract_paragraphs_from_pdf(pdf_path: str, use_ocr: bool=True) -> List[str]:
         raise
 
     with fitz.open(pdf_path) as doc:
-        for page in doc:
+        for page_no, page in enumerate(doc, start=1):
             # "blocks" 會保留相對合理的閱讀順序
             blocks = page.get_text("blocks")  # List[ (x0,y0,x1,y1, "text", block_no, block_type) ]
             blocks = sorted(blocks, key=lambda b: (round(b[1]), round(b[0])))
@@ -120,8 +150,13 @@ def extract_paragraphs_from_pdf(pdf_path: str, use_ocr: bool=True) -> List[str]:
                 if not text:
                     continue
                 # 合併頁面中的 block，以雙換行斷段
-                paragraphs.extend([p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()])
-    return paragraphs
+                bbox = (float(b[0]), float(b[1]), float(b[2]), float(b[3]))
+                segments.extend([SourceSegment(p.strip(), page_no, bbox) for p in re.split(r"\n\s*\n", text) if p.strip()])
+    return segments
+
+def extract_paragraphs_from_pdf(pdf_path: str, use_ocr: bool=True, ocr: Optional[OCRConfig]=None) -> List[str]:
+    """只要文字時用這個；頁碼/bbox 見 extract_segments_from_pdf。"""
+    return [s.text for s in extract_segments_from_pdf(pdf_path, use_ocr=use_ocr, ocr=ocr)]
 
 # ---------------------------
 # 翻譯後端（介面 + 各實作）
@@ -131,33 +166,201 @@ def extract_paragraphs_from_pdf(pdf_path: str, use_ocr: bool=True) -> List[str]:
 class TranslateConfig:
     src_lang: str = "en"
     tgt_lang: str = "zh-TW"
-    backend: str = "hf"  # hf | openai | deepl
+    backend: str = "hf"  # 見 BACKEND_REGISTRY：hf | openai | deepl | stub
     openai_model: str = "gpt-4o-mini"
     hf_model: Optional[str] = None  # "facebook/m2m100_418M" or "Helsinki-NLP/opus-mt-en-zh"
     use_opencc: bool = True
     opencc_config: str = "s2twp"  # 簡轉繁（台灣）
+    fallback_backend: Optional[str] = None  # 主後端失敗或信心過低的段落改送這個後端
+    min_confidence: float = 0.5
+    hf_workers: int = 1  # > 1 時以多行程分片推論（見 hf_workers.py）
+    hf_threads: Optional[int] = None  # 每個 worker 的 torch 執行緒數（預設：核心數 / worker 數）
+    decoding: str = "beam"  # beam | adaptive（僅 M2M100：先 greedy，檢查不過才 beam search）
+    adaptive_min_logprob: float = -1.0  # greedy 輸出的平均 token log-prob 低於此值就改用 beam search
+    glossary_path: Optional[str] = None  # 術語表（TSV 或 JSON），術語以 placeholder 保護並換成指定譯名
+    tm_path: Optional[str] = None  # 翻譯記憶（SQLite）；相同/近似段落直接沿用舊譯文
+    tm_threshold: float = 0.95  # 近似段落（只差在數字）沿用舊譯文的相似度門檻（MinHash 估計的 Jaccard）
+
+
+@dataclass
+class BackendCapabilities:
+    native_batching: bool = False   # 一次呼叫能吃多段（否則內部逐段處理）
+    max_tokens: int = 400           # 單段輸入的大約 token 上限
+    max_concurrency: int = 1        # 可同時送出的呼叫數（本機模型為 1）
+    supports_async: bool = False    # 有 atranslate_list 協程：並行呼叫改在同一個 event loop 上送出，不必各占一個執行緒
+    cost_per_1k_tokens: float = 0.0  # 約略成本（USD）；串接時用來檢查 fallback 是否比主後端貴
+    batch_size: int = 8             # 每次 translate_list 最多送幾段
+
+    @property
+    def max_chars(self) -> int:
+        # 英文約 1 token ≈ 1.5 字元（保守估計），給 split_for_translation 用
+        return self.max_tokens * 3 // 2
+
+
+BACKEND_REGISTRY: Dict[str, type] = {}
+
+def register_backend(name: str):
+    """類別裝飾器：把後端登記到 BACKEND_REGISTRY，--backend 的選項也由此而來。"""
+    def deco(cls):
+        cls.name = name
+        BACKEND_REGISTRY[name] = cls
+        return cls
+    return deco
 
 
 class TranslatorBackend:
+    name = "base"
+    capabilities = BackendCapabilities()
+
+    @classmethod
+    def from_config(cls, cfg: TranslateConfig) -> "TranslatorBackend":
+        return cls()
+
     def translate_list(self, texts: List[str], cfg: TranslateConfig) -> List[str]:
         raise NotImplementedError
 
+    async def atranslate_list(self, texts: List[str], cfg: TranslateConfig) -> List[str]:
+        """supports_async 的後端覆寫成真正的協程；預設把同步版本丟到執行緒。"""
+        import asyncio
+        return await asyncio.to_thread(self.translate_list, texts, cfg)
+
+    def score(self, source: str, translation: str, cfg: TranslateConfig) -> float:
+        """譯文的信心分數（0~1）；後端若有更好的訊號（如 log-prob）可覆寫。"""
+        return estimate_confidence(source, translation, cfg)
+
+
+_HAN_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\U00020000-\U0002fa1f]")
+
+def estimate_confidence(source: str, translation: str, cfg: TranslateConfig) -> float:
+    """
+    不需模型的便宜檢查：空白輸出、原文照抄、目標是中文卻沒有任何漢字、大量重複片語都會扣分。
+    """
+    t = translation.strip()
+    if not t:
+        return 0.0
+    if t == source.strip():
+        return 0.1
+    score = 1.0
+    if cfg.tgt_lang.lower().startswith("zh") and not _HAN_RE.search(t):
+        score -= 0.6
+    score -= min(repetition_ratio(t) * 1.5, 0.6)
+    return max(score, 0.0)
+
+def repetition_ratio(text: str, n: int=4) -> float:
+    """n-gram（中文以字、其他以詞）中重複出現的比例；模型鬼打牆時會很高。"""
+    units = list(text.replace(" ", "")) if _HAN_RE.search(text) else text.split()
+    grams = [tuple(units[i:i + n]) for i in range(len(units) - n + 1)]
+    if not grams:
+        return 0.0
+    return 1.0 - len(set(grams)) / len(grams)
 
+def greedy_output_ok(source: str, translation: str, n_in: int, n_out: int,
+                     mean_logprob: Optional[float], cfg: TranslateConfig) -> bool:
+    """
+    greedy 結果的便宜品質檢查：
+    - 輸出/輸入 token 數比例過小（漏譯）或過大（重複、胡言）
+    - n-gram 重複比例過高
+    - 平均 token log-prob 過低（模型自己也沒把握）
+    """
+    if not translation.strip():
+        return False
+    ratio = n_out / max(n_in, 1)
+    if n_in >= 8 and not (0.3 <= ratio <= 2.5):
+        return False
+    if repetition_ratio(translation) > 0.2:
+        return False
+    if mean_logprob is not None and mean_logprob < cfg.adaptive_min_logprob:
+        return False
+    return True
+
+
+@register_backend("hf")
 class HFTranslator(TranslatorBackend):
     """
     預設走 M2M100（可多語），若指定為 opus-mt-en-zh 則限英->中但較輕量。
     """
-    def __init__(self, model_name: Optional[str]=None):
-        self.model_name = model_name or "Helsinki-NLP/opus-mt-en-zh"
+    capabilities = BackendCapabilities(max_tokens=400, max_concurrency=1, batch_size=8)
+
+    DEFAULT_MODEL = "Helsinki-NLP/opus-mt-en-zh"
+
+    def __init__(self, model_name: Optional[str]=None, weights_path: Optional[str]=None):
+        self.model_name = model_name or self.DEFAULT_MODEL
+        self.weights_path = weights_path  # 指定時以 mmap 載入共用的 safetensors 權重
         self.tokenizer = None
         self.model = None
+        self.decode_stats = {"greedy": 0, "escalated": 0}  # --decoding adaptive 的統計
+
+    @classmethod
+    def from_config(cls, cfg: TranslateConfig) -> TranslatorBackend:
+        if cfg.decoding == "adaptive" and "m2m100" not in (cfg.hf_model or cls.DEFAULT_MODEL):
+            print(f"警告：--decoding adaptive 只支援 M2M100，{cfg.hf_model or cls.DEFAULT_MODEL} 仍以原本的方式解碼。",
+                  file=sys.stderr)
+        if cfg.hf_workers > 1:
+            return ShardedHFTranslator(cfg.hf_model, workers=cfg.hf_workers, threads=cfg.hf_threads)
+        return cls(model_name=cfg.hf_model)
 
     def _ensure_loaded(self):
         if self.tokenizer is not None and self.model is not None:
             return
         from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
         self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
-        self.model = AutoModelForSeq2SeqLM.from_pretrained(self.model_name)
+        if self.weights_path:
+            self.model = load_shared_model(self.model_name, self.weights_path)
+        else:
+            self.model = AutoModelForSeq2SeqLM.from_pretrained(self.model_name)
+
+    def _m2m_generate(self, text: str, forced_bos: int, greedy: bool) -> Tuple[str, int, int, Optional[float]]:
+        """
+        回傳 (譯文, 輸入 token 數, 輸出 token 數, 平均 token log-prob)。
+        greedy=False 時沿用原本的 beam search 參數，log-prob 不計算（回傳 None）。
+        """
+        # 先檢查並截斷過長的文本
+        tokens = self.tokenizer.encode(text, add_special_tokens=False)
+        if len(tokens) > 400:  # 保留空間給特殊 tokens
+            truncated_tokens = tokens[:400]
+            text = self.tokenizer.decode(truncated_tokens, skip_special_tokens=True)
+
+        # 編碼輸入，設定較小的 max_length
+        inputs = self.tokenizer(text, return_tensors="pt", max_length=400, truncation=True, padding=True)
+
+        # 移到同一設備
+        if hasattr(self.model, 'device'):
+            inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
+        n_in = int(inputs["input_ids"].shape[-1])
+
+        if greedy:
+            out = self.model.generate(
+                **inputs,
+                forced_bos_token_id=forced_bos,
+                max_new_tokens=400,
+                num_beams=1,
+                do_sample=False,
+                output_scores=True,
+                return_dict_in_generate=True,
+                pad_token_id=self.tokenizer.eos_token_id
+            )
+            scores = self.model.compute_transition_scores(out.sequences, out.scores, normalize_logits=True)[0]
+            scores = scores[scores.isfinite()]
+            mean_logprob = float(scores.mean()) if scores.numel() else None
+            translated = self.tokenizer.batch_decode(out.sequences, skip_special_tokens=True)[0]
+            return translated, n_in, int(out.sequences.shape[-1]), mean_logprob
+
+        # 生成翻譯，調整參數
+        generated_tokens = self.model.generate(
+            **inputs,
+            forced_bos_token_id=forced_bos,
+            max_new_tokens=400,  # 使用 max_new_tokens 而不是 max_length
+            num_beams=2,
+            early_stopping=True,
+            no_repeat_ngram_size=3,
+            repetition_penalty=1.2,
+            length_penalty=1.0,
+            pad_token_id=self.tokenizer.eos_token_id
+        )
+
+        # 解碼輸出
+        translated = self.tokenizer.batch_decode(generated_tokens, skip_special_tokens=True)[0]
+        return translated, n_in, int(generated_tokens.shape[-1]), None
 
     def translate_list(self, texts: List[str], cfg: TranslateConfig) -> List[str]:
         self._ensure_loaded()
@@ -171,35 +374,17 @@ class HFTranslator(TranslatorBackend):
             self.tokenizer.src_lang = cfg.src_lang
             results = []
             
+            forced_bos = self.tokenizer.get_lang_id(tgt_lang)
             for text in texts:
-                # 先檢查並截斷過長的文本
-                tokens = self.tokenizer.encode(text, add_special_tokens=False)
-                if len(tokens) > 400:  # 保留空間給特殊 tokens
-                    truncated_tokens = tokens[:400]
-                    text = self.tokenizer.decode(truncated_tokens, skip_special_tokens=True)
-                
-                # 編碼輸入，設定較小的 max_length
-                inputs = self.tokenizer(text, return_tensors="pt", max_length=400, truncation=True, padding=True)
-                
-                # 移到同一設備
-                if hasattr(self.model, 'device'):
-                    inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
-                
-                # 生成翻譯，調整參數
-                generated_tokens = self.model.generate(
-                    **inputs,
-                    forced_bos_token_id=self.tokenizer.get_lang_id(tgt_lang),
-                    max_new_tokens=400,  # 使用 max_new_tokens 而不是 max_length
-                    num_beams=2,
-                    early_stopping=True,
-                    no_repeat_ngram_size=3,
-                    repetition_penalty=1.2,
-                    length_penalty=1.0,
-                    pad_token_id=self.tokenizer.eos_token_id
-                )
-                
-                # 解碼輸出
-                translated = self.tokenizer.batch_decode(generated_tokens, skip_special_tokens=True)[0]
+                if cfg.decoding == "adaptive":
+                    # 先 greedy；通過便宜檢查就直接採用，不通過才重跑 beam search
+                    translated, n_in, n_out, mean_logprob = self._m2m_generate(text, forced_bos, greedy=True)
+                    self.decode_stats["greedy"] += 1
+                    if not greedy_output_ok(text, translated, n_in, n_out, mean_logprob, cfg):
+                        translated = self._m2m_generate(text, forced_bos, greedy=False)[0]
+                        self.decode_stats["escalated"] += 1
+                else:
+                    translated = self._m2m_generate(text, forced_bos, greedy=False)[0]
                 results.append(translated)
             
             return results
@@ -239,11 +424,77 @@ class HFTranslator(TranslatorBackend):
             return results
 
 
+class ShardedHFTranslator(TranslatorBackend):
+    """
+    HFTranslator 的多行程版本：N 個 worker 各自持有一份 HFTranslator，
+    權重經由 mmap 共用，段落切成小片段經共用佇列分派，結果依原順序組回。
+    """
+    name = "hf"
+
+    def __init__(self, model_name: Optional[str]=None, workers: Optional[int]=None,
+                 threads: Optional[int]=None, shard_size: int=2):
+        self.model_name = model_name or HFTranslator.DEFAULT_MODEL
+        self.workers, self.threads = default_split(workers, threads)
+        self.shard_size = shard_size
+        # 一次多給一些片段，讓每個 worker 都有排隊中的工作
+        self.capabilities = BackendCapabilities(max_tokens=400, batch_size=self.workers * shard_size * 4)
+        self.pool: Optional[ShardPool] = None
+
+    @property
+    def decode_stats(self) -> Dict[str, int]:
+        return self.pool.stats if self.pool is not None else {}
+
+    def _ensure_pool(self):
+        if self.pool is not None:
+            return
+        weights_path = prepare_shared_weights(self.model_name)
+        self.pool = ShardPool(HFTranslator, {"model_name": self.model_name, "weights_path": weights_path},
+                              self.workers, self.threads)
+
+    def warm_up(self):
+        """啟動 worker 並等每個 worker 都載入模型。"""
+        self._ensure_pool()
+        self.pool.wait_ready()
+
+    def translate_list(self, texts: List[str], cfg: TranslateConfig) -> List[str]:
+        if not texts:
+            return []
+        self._ensure_pool()
+        shards = [texts[i:i + self.shard_size] for i in range(0, len(texts), self.shard_size)]
+        return [t for shard in self.pool.map(shards, cfg) for t in shard]
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+
+@register_backend("openai")
 class OpenAITranslator(TranslatorBackend):
+    # 逐段呼叫，但可以多個請求同時送出
+    capabilities = BackendCapabilities(max_tokens=2000, max_concurrency=4, supports_async=True,
+                                       cost_per_1k_tokens=0.0006, batch_size=2)
+
     def __init__(self, model: str="gpt-4o-mini"):
         self.model = model
         # NOTE: 需要 `pip install openai>=1.0` 並設 OPENAI_API_KEY
 
+    @classmethod
+    def from_config(cls, cfg: TranslateConfig) -> "OpenAITranslator":
+        return cls(model=cfg.openai_model)
+
+    @staticmethod
+    def _messages(text: str) -> List[Dict[str, str]]:
+        prompt = (
+            "你是一位嚴謹的論文翻譯助手。把以下英文學術段落翻成「精準、自然的繁體中文（台灣用語）」；"
+            "保留引文標號與 DOI/URL，不要翻譯數學符號與變數名稱；必要時優化語序以更符合中文閱讀。\n\n"
+            f"段落：\n{text}"
+        )
+        return [
+            {"role": "system", "content": "You are a professional academic translator."},
+            {"role": "user", "content": prompt},
+        ]
+
     def translate_list(self, texts: List[str], cfg: TranslateConfig) -> List[str]:
         from openai import OpenAI
         import time
@@ -251,25 +502,29 @@ class OpenAITranslator(TranslatorBackend):
         out = []
         # 逐段翻譯，避免上下文過長；你也可以改成把多段塞在一個訊息裡
         for t in texts:
-            prompt = (
-                "你是一位嚴謹的論文翻譯助手。把以下英文學術段落翻成「精準、自然的繁體中文（台灣用語）」；"
-                "保留引文標號與 DOI/URL，不要翻譯數學符號與變數名稱；必要時優化語序以更符合中文閱讀。\n\n"
-                f"段落：\n{t}"
-            )
-            resp = client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a professional academic translator."},
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=0.2,
-            )
+            resp = client.chat.completions.create(model=self.model, messages=self._messages(t), temperature=0.2)
             out.append(resp.choices[0].message.content.strip())
             time.sleep(0.1)  # 輕微節流
         return out
 
+    async def atranslate_list(self, texts: List[str], cfg: TranslateConfig) -> List[str]:
+        import asyncio
+        from openai import AsyncOpenAI
+        out = []
+        async with AsyncOpenAI() as client:
+            for t in texts:
+                resp = await client.chat.completions.create(model=self.model, messages=self._messages(t), temperature=0.2)
+                out.append(resp.choices[0].message.content.strip())
+                await asyncio.sleep(0.1)  # 輕微節流
+        return out
+
 
+@register_backend("deepl")
 class DeepLTranslator(TranslatorBackend):
+    # translate_text 可以直接吃 list，一次請求翻多段
+    capabilities = BackendCapabilities(native_batching=True, max_tokens=2000, max_concurrency=2,
+                                       cost_per_1k_tokens=0.1, batch_size=32)
+
     def __init__(self):
         # 需要 pip install deepl 並設 DEEPL_API_KEY
         pass
@@ -281,19 +536,128 @@ class DeepLTranslator(TranslatorBackend):
             raise RuntimeError("需要環境變數 DEEPL_API_KEY")
         translator = deepl.Translator(auth)
         target_lang = "ZH"  # DeepL: ZH = 中文，無法直接分繁/簡；可搭配 opencc 後處理
-        out = []
-        for t in texts:
-            res = translator.translate_text(t, source_lang=cfg.src_lang.upper(), target_lang=target_lang)
-            out.append(res.text)
+        if not texts:
+            return []
+        res = translator.translate_text(list(texts), source_lang=cfg.src_lang.upper(), target_lang=target_lang)
+        return [r.text for r in res]
+
+
+@register_backend("stub")
+class StubTranslator(TranslatorBackend):
+    """
+    不需任何套件/金鑰的假後端，給路由、串接與索引流程測試用。
+    輸出為「譯：原文」；含 FAIL_MARKER 的段落原樣返回（信心分數會很低），用來觸發 fallback。
+    """
+    FAIL_MARKER = "<<STUB_FAIL>>"
+    capabilities = BackendCapabilities(native_batching=True, max_tokens=400, batch_size=16)
+
+    def __init__(self):
+        self.calls = 0
+        self.segments = 0
+        self._lock = threading.Lock()  # run_backend 可能從多個執行緒呼叫
+
+    def translate_list(self, texts: List[str], cfg: TranslateConfig) -> List[str]:
+        with self._lock:
+            self.calls += 1
+            self.segments += len(texts)
+        return [t if self.FAIL_MARKER in t else "譯：" + t for t in texts]
+
+
+class CascadeTranslator(TranslatorBackend):
+    """
+    串接策略：先全部交給 primary（通常是本機 HF），
+    呼叫失敗或 score 低於 min_confidence 的段落才送 fallback（通常是付費 API）。
+    """
+    def __init__(self, primary: TranslatorBackend, fallback: TranslatorBackend, min_confidence: float=0.5):
+        self.primary = primary
+        self.fallback = fallback
+        self.min_confidence = min_confidence
+        self.name = f"{primary.name}->{fallback.name}"
+        # 同一批段落可能整批改送 fallback：切段長度要兩邊都吃得下，否則較小的後端會默默截斷；
+        # 串接本身沒有協程版本
+        self.capabilities = dataclasses.replace(
+            primary.capabilities,
+            max_tokens=min(primary.capabilities.max_tokens, fallback.capabilities.max_tokens),
+            supports_async=False,
+        )
+        self.escalated = 0
+        self._lock = threading.Lock()  # 外層 run_backend 可能從多個執行緒呼叫
+
+    def translate_list(self, texts: List[str], cfg: TranslateConfig) -> List[str]:
+        try:
+            out = run_backend(self.primary, texts, cfg)
+        except Exception as e:
+            print(f"警告：{self.primary.name} 翻譯失敗，改用 {self.fallback.name}：{e}", file=sys.stderr)
+            out = [""] * len(texts)
+        retry = [i for i, (src, tr) in enumerate(zip(texts, out))
+                 if self.primary.score(src, tr, cfg) < self.min_confidence]
+        if retry:
+            with self._lock:
+                self.escalated += len(retry)
+            again = run_backend(self.fallback, [texts[i] for i in retry], cfg)
+            for i, tr in zip(retry, again):
+                out[i] = tr
         return out
 
+class MemoryTranslator(TranslatorBackend):
+    """
+    在任何後端前面加一層翻譯記憶：命中（完全相同或近似）的段落直接用舊譯文，
+    其餘才交給內層後端，翻完且信心分數夠高的結果寫回記憶。
+    """
+    def __init__(self, inner: TranslatorBackend, tm: TranslationMemory, min_confidence: float=0.5):
+        self.inner = inner
+        self.tm = tm
+        self.min_confidence = min_confidence
+        self.name = f"tm+{inner.name}"
+        # SQLite 連線不能跨執行緒共用：這一層單執行緒，平行交給 run_backend(inner)
+        caps = inner.capabilities
+        self.capabilities = dataclasses.replace(caps, max_concurrency=1, batch_size=caps.batch_size * caps.max_concurrency,
+                                                supports_async=False)
+        self.stats = {"exact": 0, "fuzzy": 0, "miss": 0}
+
+    def translate_list(self, texts: List[str], cfg: TranslateConfig) -> List[str]:
+        scope = tm_scope(cfg)
+        out: List[str] = [""] * len(texts)
+        miss: List[int] = []
+        for i, t in enumerate(texts):
+            hit = self.tm.lookup(t, scope)
+            if hit is None:
+                miss.append(i)
+            else:
+                out[i] = hit.translation
+                self.stats[hit.kind] += 1
+        self.stats["miss"] += len(miss)
+        if miss:
+            translated = run_backend(self.inner, [texts[i] for i in miss], cfg)
+            for i, tr in zip(miss, translated):
+                out[i] = tr
+            self.tm.add_many(
+                ((texts[i], out[i]) for i in miss if self.inner.score(texts[i], out[i], cfg) >= self.min_confidence),
+                scope,
+            )
+        return out
+
+def tm_scope(cfg: TranslateConfig) -> str:
+    """翻譯記憶的分區：後端（含串接的 fallback）與各自的模型 + 語言對，換後端或模型不會沿用別的設定的譯文。"""
+    def model(name: str) -> str:
+        if name == "openai":
+            return cfg.openai_model
+        if name == "hf":
+            return cfg.hf_model or HFTranslator.DEFAULT_MODEL
+        return ""
+    parts = [cfg.backend, model(cfg.backend)]
+    if cfg.fallback_backend:
+        parts += [cfg.fallback_backend, model(cfg.fallback_backend)]
+    return "\x00".join(parts + [cfg.src_lang, cfg.tgt_lang])
+
 # ---------------------------
 # 主流程
 # ---------------------------
 
-def split_for_translation(paragraphs: List[str], max_chars: int=400) -> List[str]:  # 降低到 400
+def split_for_translation(paragraphs: List[str], max_chars: int=400, pack: bool=True) -> List[str]:  # 降低到 400
     """
     基於字數簡單分批，使用更小的 max_chars 避免超過模型限制。
+    pack=False 時不把短段落併成一批，每段各自成批（翻譯記憶以段落為單位比對時使用）。
     """
     batches: List[str] = []
     buf = []
@@ -321,7 +685,7 @@ def split_for_translation(paragraphs: List[str], max_chars: int=400) -> List[str
                     current_chunk += " " + sent if current_chunk else sent
             if current_chunk:
                 batches.append(current_chunk.strip())
-        elif size + len(p) > max_chars and buf:
+        elif (size + len(p) > max_chars or not pack) and buf:
             batches.append("\n\n".join(buf))
             buf = [p]
             size = len(p)
@@ -333,46 +697,371 @@ def split_for_translation(paragraphs: List[str], max_chars: int=400) -> List[str
         batches.append("\n\n".join(buf))
     return batches
 def build_backend(cfg: TranslateConfig) -> TranslatorBackend:
-    if cfg.backend == "hf":
-        return HFTranslator(model_name=cfg.hf_model)
-    elif cfg.backend == "openai":
-        return OpenAITranslator(model=cfg.openai_model)
-    elif cfg.backend == "deepl":
-        return DeepLTranslator()
+    def make(name: str) -> TranslatorBackend:
+        try:
+            cls = BACKEND_REGISTRY[name]
+        except KeyError:
+            raise ValueError(f"未知後端：{name}")
+        return cls.from_config(cfg)
+
+    backend = make(cfg.backend)
+    if cfg.fallback_backend:
+        fallback = make(cfg.fallback_backend)
+        if fallback.capabilities.cost_per_1k_tokens < backend.capabilities.cost_per_1k_tokens:
+            print(f"警告：fallback {fallback.name} 比主後端 {backend.name} 便宜"
+                  f"（{fallback.capabilities.cost_per_1k_tokens} vs {backend.capabilities.cost_per_1k_tokens} USD/1k tokens），"
+                  "串接通常應由便宜的後端先翻、必要時才改送較貴的後端。", file=sys.stderr)
+        backend = CascadeTranslator(backend, fallback, min_confidence=cfg.min_confidence)
+    if cfg.tm_path:
+        tm = TranslationMemory(cfg.tm_path, threshold=cfg.tm_threshold)
+        backend = MemoryTranslator(backend, tm, min_confidence=cfg.min_confidence)
+    return backend
+
+def report_backend(backend: Optional[TranslatorBackend]):
+    if isinstance(backend, MemoryTranslator):
+        st = backend.stats
+        print(f"翻譯記憶：完全相同 {st['exact']}、近似沿用 {st['fuzzy']}、未命中 {st['miss']} 段（記憶共 {len(backend.tm)} 段）")
+        report_backend(backend.inner)
+        return
+    if isinstance(backend, CascadeTranslator):
+        print(f"串接後端 {backend.name}：{backend.escalated} 段改送 {backend.fallback.name}")
+        report_backend(backend.primary)
+        return
+    stats = getattr(backend, "decode_stats", None)
+    if stats and stats.get("greedy"):
+        print(f"adaptive 解碼：{stats['greedy']} 段先以 greedy 翻譯，其中 {stats['escalated']} 段改用 beam search")
+
+def plan_batches(texts: List[str], caps: BackendCapabilities) -> List[List[str]]:
+    """
+    依後端宣告的 capabilities 切批：
+    - native_batching：整批在一次請求內送出，每批不超過 batch_size 段，
+      總長也不超過 batch_size * max_chars 字元（單次請求的大小上限）
+    - 否則後端內部逐段呼叫，批次只是分給並行呼叫的工作單位：
+      段落平均分給 max_concurrency 個並行槽，每批不超過 batch_size 段
+    """
+    if not texts:
+        return []
+    if caps.native_batching:
+        limit = caps.batch_size * caps.max_chars
+        batches: List[List[str]] = []
+        size = 0
+        for t in texts:
+            if not batches or len(batches[-1]) >= caps.batch_size or (size + len(t) > limit and batches[-1]):
+                batches.append([])
+                size = 0
+            batches[-1].append(t)
+            size += len(t)
+        return batches
+    per_batch = max(1, min(caps.batch_size, -(-len(texts) // caps.max_concurrency)))
+    return [texts[i:i + per_batch] for i in range(0, len(texts), per_batch)]
+
+async def _gather_batches(backend: TranslatorBackend, batches: List[List[str]], cfg: TranslateConfig,
+                          limit: int) -> List[List[str]]:
+    import asyncio
+    sem = asyncio.Semaphore(limit)
+    async def one(batch):
+        async with sem:
+            return await backend.atranslate_list(batch, cfg)
+    return await asyncio.gather(*(one(b) for b in batches))
+
+def run_backend(backend: TranslatorBackend, texts: List[str], cfg: TranslateConfig) -> List[str]:
+    """
+    依 plan_batches 切批；max_concurrency > 1 時同時送出多批（API 後端多半卡在網路延遲），結果維持原順序：
+    supports_async 的後端在一個 event loop 上以 atranslate_list 並行，其他後端用 thread pool。
+    """
+    caps = backend.capabilities
+    batches = plan_batches(list(texts), caps)
+    if len(batches) <= 1:
+        return backend.translate_list(batches[0], cfg) if batches else []
+    if caps.max_concurrency > 1 and caps.supports_async:
+        import asyncio
+        results = asyncio.run(_gather_batches(backend, batches, cfg, caps.max_concurrency))
+    elif caps.max_concurrency > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=min(caps.max_concurrency, len(batches))) as pool:
+            results = list(pool.map(lambda b: backend.translate_list(b, cfg), batches))
     else:
-        raise ValueError(f"未知後端：{cfg.backend}")
+        results = [backend.translate_list(b, cfg) for b in batches]
+    return [t for r in results for t in r]
 
-def maybe_opencc_to_tw(texts: List[str], cfg: TranslateConfig) -> List[str]:
-    if not cfg.use_opencc:
-        return texts
+# ---------------------------
+# OpenCC 簡轉繁（整個行程共用一個轉換器，批次轉換）
+# ---------------------------
+
+_OPENCC_CONVERTERS: Dict[str, object] = {}
+_OPENCC_TRIGGERS: Dict[str, Optional[tuple]] = {}
+_OPENCC_MISSING = False
+_OPENCC_POOL = None
+
+# 以私用區字元當分隔，不會出現在 OpenCC 字典裡，也不會和前後文組成詞
+OPENCC_SENTINEL = "\n\ue000\n"
+
+def get_opencc_converter(config: str):
+    """同一個 config 在整個行程只建立一次轉換器；未安裝 opencc 時回傳 None（只警告一次）。"""
+    global _OPENCC_MISSING
+    conv = _OPENCC_CONVERTERS.get(config)
+    if conv is not None or _OPENCC_MISSING:
+        return conv
     try:
         import opencc
     except Exception:
         print("警告：未安裝 opencc，將跳過簡轉繁（台灣用語）步驟。", file=sys.stderr)
+        _OPENCC_MISSING = True
+        return None
+    conv = opencc.OpenCC(config)
+    _OPENCC_CONVERTERS[config] = conv
+    return conv
+
+def opencc_change_triggers(config: str) -> Optional[Tuple[frozenset, Dict[str, Tuple[str, ...]]]]:
+    """
+    由 config 的轉換鏈字典找出「會改字」的條目：回傳 (單字 key 集合, 詞組 key 依首字分組)。
+    段落不含任何這些 key 時，沒有條目能改動它，轉換結果必定與原文相同，可直接略過；
+    已是繁體的段落（例如 Gemini 潤飾後再轉一次）大多在這裡就略過。
+    讀不到 txt 字典（例如改裝了 C++ 版 opencc）時回傳 None，退回「含漢字才轉換」。
+    """
+    if config in _OPENCC_TRIGGERS:
+        return _OPENCC_TRIGGERS[config]
+    triggers = None
+    try:
+        import json
+        import opencc
+        base = os.path.dirname(opencc.__file__)
+        with open(os.path.join(base, "config", config + ".json"), "r", encoding="utf-8") as f:
+            setting = json.load(f)
+
+        def dict_files(d):
+            if d.get("type") == "group":
+                for sub in d.get("dicts", []):
+                    yield from dict_files(sub)
+            elif d.get("type") == "txt":
+                yield os.path.join(base, "dictionary", d["file"])
+
+        keys = set()
+        for step in setting.get("conversion_chain", []):
+            for path in dict_files(step.get("dict", {})):
+                with open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        key, _, value = line.strip().partition("\t")
+                        first = value.split(" ")[0]  # 多個候選時 opencc 取第一個
+                        if first and first != key:
+                            keys.add(key)
+        chars = frozenset(k for k in keys if len(k) == 1)
+        phrases: Dict[str, List[str]] = {}
+        for k in keys:
+            # 含單字 key 的詞組已由 chars 涵蓋
+            if len(k) > 1 and chars.isdisjoint(k):
+                phrases.setdefault(k[0], []).append(k)
+        triggers = (chars, {c: tuple(ks) for c, ks in phrases.items()})
+    except (ImportError, OSError, ValueError, KeyError):
+        triggers = None
+    _OPENCC_TRIGGERS[config] = triggers
+    return triggers
+
+def _needs_opencc(text: str, triggers) -> bool:
+    if triggers is None:
+        return bool(_HAN_RE.search(text))
+    chars, phrases = triggers
+    if not chars.isdisjoint(text):
+        return True
+    if phrases.keys().isdisjoint(text):
+        return False
+    for i, c in enumerate(text):
+        ks = phrases.get(c)
+        if ks and any(text.startswith(k, i) for k in ks):
+            return True
+    return False
+
+def _opencc_convert_joined(job: Tuple[str, str]) -> str:
+    # ProcessPoolExecutor 的 worker；每個子行程各自快取一個轉換器
+    config, joined = job
+    return get_opencc_converter(config).convert(joined)
+
+def _get_opencc_pool(workers: Optional[int]):
+    """
+    整個行程共用一個轉換用的 process pool，串流各階段反覆呼叫也只啟動一次。
+    pool 在管線中途才建立，此時 torch / gRPC 已有執行緒在跑，和 hf_workers.ShardPool 一樣用 spawn 避免 fork 後卡死。
+    """
+    global _OPENCC_POOL
+    if _OPENCC_POOL is None:
+        import atexit
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        _OPENCC_POOL = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        atexit.register(_OPENCC_POOL.shutdown)
+    return _OPENCC_POOL
+
+def opencc_convert_batch(texts: List[str], config: str, batch_chars: int=8000,
+                         parallel_chars: int=24000, workers: Optional[int]=None) -> List[str]:
+    """
+    把需要轉換的段落以 OPENCC_SENTINEL 串成大字串一次轉換，減少逐段呼叫的額外成本；
+    總字數達 parallel_chars（約三批，iter_opencc_to_tw 一組 64 段的常見大小）且有多核心時，
+    各批交給共用的 process pool 平行轉換。
+    """
+    conv = get_opencc_converter(config)
+    if conv is None:
+        return list(texts)
+    out = list(texts)
+    triggers = opencc_change_triggers(config)
+    todo = [i for i, t in enumerate(texts) if _needs_opencc(t, triggers)]
+    if not todo:
+        return out
+
+    groups: List[List[int]] = []
+    size = 0
+    for i in todo:
+        if not groups or size + len(texts[i]) > batch_chars:
+            groups.append([])
+            size = 0
+        groups[-1].append(i)
+        size += len(texts[i])
+    jobs = [(config, OPENCC_SENTINEL.join(texts[i] for i in g)) for g in groups]
+
+    total = sum(len(j[1]) for j in jobs)
+    if len(jobs) > 1 and total >= parallel_chars and workers != 1 and (workers or os.cpu_count() or 1) > 1:
+        converted = list(_get_opencc_pool(workers).map(_opencc_convert_joined, jobs))
+    else:
+        converted = [conv.convert(j[1]) for j in jobs]
+
+    for g, c in zip(groups, converted):
+        parts = c.split(OPENCC_SENTINEL)
+        if len(parts) != len(g):
+            # 理論上不會發生；保險起見退回逐段轉換
+            parts = [conv.convert(texts[i]) for i in g]
+        for i, p in zip(g, parts):
+            out[i] = p
+    return out
+
+def maybe_opencc_to_tw(texts: List[str], cfg: TranslateConfig) -> List[str]:
+    if not cfg.use_opencc:
         return texts
-    conv = opencc.OpenCC(cfg.opencc_config)
-    return [conv.convert(t) for t in texts]
+    return opencc_convert_batch(texts, cfg.opencc_config)
+
+# ---------------------------
+# 輸出寫入器（逐段寫出 + 定期 flush）
+# ---------------------------
 
-def write_markdown(paragraphs: List[str], out_path: str, meta: Optional[dict]=None):
-    with open(out_path, "w", encoding="utf-8") as f:
+class MarkdownStreamWriter:
+    """
+    逐段寫出 Markdown，不需要先把整份譯文收集成 list。
+    每累積 flush_every 段或距上次 flush 超過 flush_interval 秒就 flush 一次，
+    記憶體用量與文件長度無關，`tail -f` 也能即時看到進度。
+    """
+    def __init__(self, out_path: str, meta: Optional[dict]=None,
+                 flush_every: int=20, flush_interval: float=2.0):
+        self.out_path = out_path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.count = 0
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self._f = open(out_path, "w", encoding="utf-8")
         if meta:
-            f.write("---\n")
-            for k,v in meta.items():
-                f.write(f"{k}: {v}\n")
-            f.write("---\n\n")
+            self._f.write("---\n")
+            for k, v in meta.items():
+                self._f.write(f"{k}: {v}\n")
+            self._f.write("---\n\n")
+        self.flush()
+
+    def write(self, paragraph: str):
+        self._f.write(paragraph.strip() + "\n\n")
+        self.count += 1
+        self._pending += 1
+        if self._pending >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def write_source(self, paragraph: str):
+        """對照模式：原文以引言區塊寫在譯文前。"""
+        quoted = "\n".join("> " + line for line in paragraph.strip().splitlines())
+        self._f.write(quoted + "\n\n")
+
+    def flush(self):
+        self._f.flush()
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        if self._f.closed:
+            return
+        self.flush()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class DocxStreamWriter:
+    """
+    逐段加入 python-docx 的 Document（段落只存在 Document 內部，不另外保留 list）。
+    .docx 是 zip 格式無法附加寫入，所以定期以「先存暫存檔再 os.replace」的方式落地，
+    讀者看到的永遠是一份完整可開啟的檔案。
+    """
+    def __init__(self, out_path: str, flush_every: int=200, flush_interval: float=30.0):
+        try:
+            from docx import Document
+        except Exception:
+            raise RuntimeError("需要安裝 python-docx 才能輸出 .docx")
+        self.out_path = out_path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.count = 0
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self._closed = False
+        self.doc = Document()
+
+    def write(self, paragraph: str):
+        self.doc.add_paragraph(paragraph)
+        self.doc.add_paragraph("")  # 空行
+        self.count += 1
+        self._pending += 1
+        if self._pending >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def write_source(self, paragraph: str):
+        """對照模式：原文以 Quote 樣式寫在譯文前。"""
+        self.doc.add_paragraph(paragraph, style="Quote")
+
+    def flush(self):
+        tmp_path = self.out_path + ".tmp"
+        self.doc.save(tmp_path)
+        os.replace(tmp_path, self.out_path)
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def open_writer(out_path: str, meta: Optional[dict]=None):
+    """依副檔名選擇寫入器。"""
+    if out_path.lower().endswith(".md"):
+        return MarkdownStreamWriter(out_path, meta=meta)
+    elif out_path.lower().endswith(".docx"):
+        return DocxStreamWriter(out_path)
+    else:
+        raise ValueError("輸出副檔名需為 .md 或 .docx")
+
+def write_markdown(paragraphs: Iterable[str], out_path: str, meta: Optional[dict]=None):
+    with MarkdownStreamWriter(out_path, meta=meta) as w:
         for p in paragraphs:
-            f.write(p.strip() + "\n\n")
+            w.write(p)
 
-def write_docx(paragraphs: List[str], out_path: str):
-    try:
-        from docx import Document
-    except Exception:
-        raise RuntimeError("需要安裝 python-docx 才能輸出 .docx")
-    doc = Document()
-    for p in paragraphs:
-        doc.add_paragraph(p)
-        doc.add_paragraph("")  # 空行
-    doc.save(out_path)
+def write_docx(paragraphs: Iterable[str], out_path: str):
+    with DocxStreamWriter(out_path) as w:
+        for p in paragraphs:
+            w.write(p)
 
 def gemini_refine(msg: str) -> str:
     import os
@@ -386,87 +1075,315 @@ def gemini_refine(msg: str) -> str:
     prompt = msg + '\n\n因為現在的內容可能有些生硬或不夠流暢。\n請幫我把以上文字稍微潤飾一下，使其更通順自然。注意不要有任何其他多餘的回覆'
     response = model.generate_content(prompt)
     return response.text
+
+# ---------------------------
+# 串流處理階段（翻譯 -> 潤飾 -> 簡轉繁，逐段往下游送）
+# ---------------------------
+
+def iter_translated_paragraphs(masked_batches: List[str], math_maps: List[Dict[str, str]],
+                               backend: TranslatorBackend, cfg: TranslateConfig,
+                               group_size: Optional[int]=None) -> Iterator[str]:
+    """
+    每次只送 group_size 個批次給後端，翻完就還原數學式、簡轉繁並拆回段落往下游送，
+    寫入器可以邊翻邊寫，不必等整篇翻完。group_size 預設為後端一輪平行可處理的量。
+    """
+    caps = backend.capabilities
+    group_size = group_size or caps.batch_size * caps.max_concurrency
+    for i in range(0, len(masked_batches), group_size):
+        translated = run_backend(backend, masked_batches[i:i + group_size], cfg)
+        restored = [unmask_math(tb, mp) for tb, mp in zip(translated, math_maps[i:i + group_size])]
+        restored = maybe_opencc_to_tw(restored, cfg)
+        for b in restored:
+            for p in re.split(r"\n\s*\n", b):
+                if p.strip():
+                    yield p.strip()
+
+def refine_paragraphs_stream(paragraphs: Iterable[str], max_chars: int=3000) -> Iterator[str]:
+    """
+    以 Gemini 逐塊潤飾：累積到約 max_chars 字就送出一次，取代「整檔讀入 -> 潤飾 -> 整檔寫回」。
+    某一塊潤飾失敗時保留原文，不影響其他段落。
+    """
+    def refine_chunk(chunk: List[str]) -> List[str]:
+        try:
+            refined = gemini_refine("\n\n".join(chunk))
+        except Exception as e:
+            print(f"警告：Gemini 潤飾失敗，保留原文：{e}", file=sys.stderr)
+            return chunk
+        return [p.strip() for p in re.split(r"\n\s*\n", refined) if p.strip()]
+
+    buf: List[str] = []
+    size = 0
+    for p in paragraphs:
+        if size + len(p) > max_chars and buf:
+            yield from refine_chunk(buf)
+            buf = []
+            size = 0
+        buf.append(p)
+        size += len(p)
+    if buf:
+        yield from refine_chunk(buf)
+
+def iter_opencc_to_tw(paragraphs: Iterable[str], cfg: TranslateConfig, batch_size: int=64) -> Iterator[str]:
+    """maybe_opencc_to_tw 的串流版本：累積 batch_size 段再批次轉換。"""
+    if not cfg.use_opencc:
+        yield from paragraphs
+        return
+    buf: List[str] = []
+    for p in paragraphs:
+        buf.append(p)
+        if len(buf) >= batch_size:
+            yield from maybe_opencc_to_tw(buf, cfg)
+            buf = []
+    if buf:
+        yield from maybe_opencc_to_tw(buf, cfg)
+
+# ---------------------------
+# 段落對齊模式（搭配 segment_index）
+# ---------------------------
+
+_GLOSSARY_DIGESTS: Dict[str, str] = {}
+
+def translation_settings(cfg: TranslateConfig) -> str:
+    """
+    影響譯文的設定：tm_scope（後端、fallback、各自的模型、語言對）+ 術語表內容 + 解碼方式。
+    任一項不同，改版時就不沿用舊譯文。
+    """
+    glossary = ""
+    if cfg.glossary_path:
+        if cfg.glossary_path not in _GLOSSARY_DIGESTS:
+            _GLOSSARY_DIGESTS[cfg.glossary_path] = file_sha256(cfg.glossary_path)
+        glossary = _GLOSSARY_DIGESTS[cfg.glossary_path]
+    return "\x00".join([tm_scope(cfg), glossary, cfg.decoding])
+
+def segment_cache_key(text: str, cfg: TranslateConfig) -> str:
+    return make_cache_key(text, translation_settings(cfg))
+
+def translate_segments(texts: List[str], backend: TranslatorBackend, cfg: TranslateConfig,
+                       max_chars: Optional[int]=None) -> List[str]:
+    """
+    一段原文對應一段譯文（不像主流程那樣把多段併成一批，翻完再靠空行拆回）。
+    過長的段落依句子切塊，各塊 mask 數學式後一起送後端，翻完再接回同一段。
+    """
+    max_chars = max_chars or backend.capabilities.max_chars
+    chunks: List[str] = []
+    maps: List[Dict[str, str]] = []
+    owners: List[int] = []
+    for i, t in enumerate(texts):
+        for c in split_for_translation([t], max_chars=max_chars):
+            masked, mp = mask_for_translation(c, cfg)
+            chunks.append(masked)
+            maps.append(mp)
+            owners.append(i)
+    translated = run_backend(backend, chunks, cfg)
+    restored = maybe_opencc_to_tw([unmask_math(t, mp) for t, mp in zip(translated, maps)], cfg)
+
+    joiner = "" if cfg.tgt_lang.lower().startswith("zh") else " "
+    parts: List[List[str]] = [[] for _ in texts]
+    for i, r in zip(owners, restored):
+        parts[i].append(r.strip())
+    return [joiner.join(p) for p in parts]
+
+def build_segment_index(segments: List[SourceSegment], index: SegmentIndex,
+                        backend: TranslatorBackend, cfg: TranslateConfig, group_size: Optional[int]=None,
+                        prev_records: Optional[List[SegmentRecord]]=None,
+                        meta: Optional[Dict[str, str]]=None) -> Dict[str, int]:
+    """
+    逐組翻譯並寫入索引的 staging 表；每組各自 commit，全部完成後才一次換上正式內容，
+    中途中斷時索引仍保有上一次的完整結果（--prev-index 與 --index 為同一檔時也不會遺失舊譯文）。
+    給了 prev_records（上一版的索引內容）時，先把新版段落對回舊段落，
+    正規化後內容完全相同且翻譯設定相同的段落直接沿用舊譯文，只翻新增或改動的段落。
+    """
+    stats = {"exact": 0, "changed": 0, "new": 0, "translated_chars": 0, "reused_chars": 0}
+    todo = list(range(len(segments)))
+    reused: List[SegmentRecord] = []
+    if prev_records:
+        todo = []
+        matches = match_previous([s.text for s in segments], prev_records)
+        for i, (s, m) in enumerate(zip(segments, matches)):
+            stats[m.kind] += 1
+            if (m.kind == "exact" and m.record.translation
+                    and m.record.cache_key == segment_cache_key(m.record.source, cfg)):
+                # cache_key 沿用舊紀錄的：它描述的是譯文實際由哪段原文、哪組設定產生
+                reused.append(SegmentRecord(i, s.page, s.bbox, s.text, m.record.translation, m.record.cache_key))
+                stats["reused_chars"] += len(s.text)
+            else:
+                todo.append(i)
+
+    index.begin_rebuild()
+    index.put_many(reused, staging=True)
+    group_size = group_size or backend.capabilities.batch_size * backend.capabilities.max_concurrency
+    for start in range(0, len(todo), group_size):
+        group = todo[start:start + group_size]
+        translations = translate_segments([segments[i].text for i in group], backend, cfg)
+        index.put_many(
+            (SegmentRecord(i, segments[i].page, segments[i].bbox, segments[i].text, t,
+                           segment_cache_key(segments[i].text, cfg))
+             for i, t in zip(group, translations)),
+            staging=True,
+        )
+        stats["translated_chars"] += sum(len(segments[i].text) for i in group)
+    index.commit_rebuild(meta)
+    return stats
+
+def retranslate_segments(index: SegmentIndex, seg_ids: List[int],
+                         backend: TranslatorBackend, cfg: TranslateConfig):
+    """只重翻指定段落，就地更新索引。"""
+    records = []
+    for seg_id in seg_ids:
+        r = index.get(seg_id)
+        if r is None:
+            raise ValueError(f"索引中沒有段落 {seg_id}")
+        records.append(r)
+    translations = translate_segments([r.source for r in records], backend, cfg)
+    for r, t in zip(records, translations):
+        index.update_translation(r.seg_id, t, segment_cache_key(r.source, cfg))
+
+def write_from_index(index: SegmentIndex, out_path: str, bilingual: bool=False):
+    """不呼叫任何後端，直接由索引產生 .md / .docx。"""
+    meta = {k: v for k, v in index.get_meta().items() if k == "source_pdf"}
+    with open_writer(out_path, meta=meta or None) as writer:
+        for r in index:
+            if bilingual:
+                writer.write_source(r.source)
+            writer.write(r.translation)
+
 def main():
     ap = argparse.ArgumentParser(description="把 PDF 學術論文翻成繁體中文（含數學式保護）。")
-    ap.add_argument("pdf", help="輸入 PDF 路徑")
+    ap.add_argument("pdf", nargs="?", help="輸入 PDF 路徑（--from-index / --retranslate 時可省略）")
     ap.add_argument("--out", required=True, help="輸出檔（.md 或 .docx）")
-    ap.add_argument("--backend", choices=["hf", "openai", "deepl"], default="hf", help="翻譯後端（預設 hf）")
+    ap.add_argument("--backend", choices=sorted(BACKEND_REGISTRY), default="hf", help="翻譯後端（預設 hf）")
+    ap.add_argument("--fallback-backend", choices=sorted(BACKEND_REGISTRY), default=None,
+                    help="串接備援：主後端失敗或信心過低的段落改用此後端（例如 --backend hf --fallback-backend openai）")
+    ap.add_argument("--hf-workers", type=int, default=1, help="HF 後端的 worker 行程數（>1 時多行程分片推論，權重以 mmap 共用）")
+    ap.add_argument("--hf-threads", type=int, default=None, help="每個 HF worker 的 torch 執行緒數（預設：核心數 / worker 數）")
+    ap.add_argument("--decoding", choices=["beam", "adaptive"], default="beam",
+                    help="M2M100 解碼策略：beam（每段都 beam search）或 adaptive（先 greedy，品質檢查不過才 beam；僅支援 M2M100）")
+    ap.add_argument("--adaptive-min-logprob", type=float, default=-1.0, help="adaptive 模式下 greedy 輸出平均 log-prob 的門檻")
+    ap.add_argument("--glossary", default=None, help="術語表（每行「術語<TAB>譯名」或 JSON），翻譯時保護術語並統一譯名")
+    ap.add_argument("--tm", default=None, help="翻譯記憶（SQLite）路徑；相同或近似段落沿用舊譯文，不呼叫模型")
+    ap.add_argument("--tm-threshold", type=float, default=0.95, help="近似段落（只差在數字）沿用舊譯文的相似度門檻（預設 0.95；設為 1.0 只沿用完全相同的段落）")
+    ap.add_argument("--min-confidence", type=float, default=0.5, help="低於此信心分數的段落送 fallback（預設 0.5）")
     ap.add_argument("--openai-model", default="gpt-4o-mini", help="OpenAI 模型名")
     ap.add_argument("--hf-model", default=None, help="HF 模型名（預設 Helsinki-NLP/opus-mt-en-zh；若英->中可用 Helsinki-NLP/opus-mt-en-zh）也可以用 facebook/m2m100_418M ")
     ap.add_argument("--src", dest="src_lang", default="en", help="來源語言代碼（如 en、ja、de；M2M100 需要）")
     ap.add_argument("--tgt", dest="tgt_lang", default="zh-TW", help="目標語言代碼（M2M100 支援 zh-CN/zh-TW 等）")
     ap.add_argument("--no-opencc", default=False, action="store_true", help="停用簡轉繁（台灣用語）")
     ap.add_argument("--ocr", default=True, action="store_true", help="掃描型 PDF 開啟 OCR")
+    ap.add_argument("--ocr-lang", default="eng", help="tesseract 語言（預設 eng）")
+    ap.add_argument("--ocr-dpi", type=int, default=300, help="OCR 轉圖 DPI（adaptive 模式下為最高 DPI）")
+    ap.add_argument("--ocr-adaptive", action="store_true", help="先以低 DPI 辨識，tesseract 信心不足的頁面才提高 DPI 重做")
+    ap.add_argument("--ocr-min-conf", type=float, default=80.0, help="adaptive 模式下每頁平均單字信心的門檻（0~100）")
+    ap.add_argument("--no-ocr-cache", action="store_true", help="不讀寫 OCR 快取（~/.cache/arxiv-reader/ocr）")
+    ap.add_argument("--index", default=None, help="段落索引（SQLite）路徑；指定後逐段對齊翻譯，記錄原文、頁碼、bbox 與 cache key")
+    ap.add_argument("--bilingual", action="store_true", help="輸出原文/譯文對照（未指定 --index 時索引存在輸出檔旁）")
+    ap.add_argument("--from-index", action="store_true", help="不呼叫翻譯後端，直接由 --index 重新產生輸出")
+    ap.add_argument("--retranslate", default=None, help="只重翻 --index 中的指定段落（例如 3,7-9），再重新產生輸出")
+    ap.add_argument("--prev-index", default=None, help="上一版論文的段落索引；只翻新版中新增或改動的段落（可與 --index 相同）")
     args = ap.parse_args()
 
+    if (args.from_index or args.retranslate) and not args.index:
+        ap.error("--from-index / --retranslate 需要搭配 --index")
+    if not args.pdf and not (args.from_index or args.retranslate):
+        ap.error("需要輸入 PDF 路徑")
+    if args.prev_index and not args.index:
+        ap.error("--prev-index 需要搭配 --index")
+    if args.decoding == "adaptive":
+        hf_model = args.hf_model or HFTranslator.DEFAULT_MODEL
+        if "hf" not in (args.backend, args.fallback_backend) or "m2m100" not in hf_model:
+            ap.error(f"--decoding adaptive 只支援 HF 後端的 M2M100 模型（目前：--backend {args.backend}、模型 {hf_model}）；"
+                     "例如 --backend hf --hf-model facebook/m2m100_418M")
+    if args.bilingual and not args.index:
+        args.index = os.path.splitext(args.out)[0] + ".segments.sqlite"
+
     cfg = TranslateConfig(
         src_lang=args.src_lang,
         tgt_lang=args.tgt_lang,
         backend=args.backend,
         openai_model=args.openai_model,
         hf_model=args.hf_model,
-        use_opencc=not args.no_opencc
+        use_opencc=not args.no_opencc,
+        fallback_backend=args.fallback_backend,
+        min_confidence=args.min_confidence,
+        hf_workers=args.hf_workers,
+        hf_threads=args.hf_threads,
+        decoding=args.decoding,
+        adaptive_min_logprob=args.adaptive_min_logprob,
+        glossary_path=args.glossary,
+        tm_path=args.tm,
+        tm_threshold=args.tm_threshold,
     )
 
+    ocr = OCRConfig(
+        lang=args.ocr_lang,
+        dpi=args.ocr_dpi,
+        adaptive=args.ocr_adaptive,
+        min_confidence=args.ocr_min_conf,
+        cache_dir=None if args.no_ocr_cache else OCR_CACHE_DIR,
+    )
+
+    # 段落對齊模式：結果先進索引，再由索引產生輸出
+    # （Gemini 潤飾會重新斷段、破壞對齊，所以這個模式不做潤飾）
+    if args.index:
+        backend = None
+        with SegmentIndex(args.index) as index:
+            if args.retranslate:
+                backend = build_backend(cfg)
+                retranslate_segments(index, parse_id_list(args.retranslate), backend, cfg)
+            elif not args.from_index:
+                prev_records = None
+                if args.prev_index:
+                    with SegmentIndex(args.prev_index) as prev:
+                        prev_records = list(prev)
+                segments = extract_segments_from_pdf(args.pdf, use_ocr=args.ocr, ocr=ocr)
+                meta = {
+                    "source_pdf": os.path.abspath(args.pdf),
+                    "backend": cfg.backend,
+                    "src_lang": cfg.src_lang,
+                    "tgt_lang": cfg.tgt_lang,
+                }
+                backend = build_backend(cfg)
+                stats = build_segment_index(segments, index, backend, cfg, prev_records=prev_records, meta=meta)
+                if prev_records is not None:
+                    total = stats["translated_chars"] + stats["reused_chars"]
+                    print(f"改版比對：相同 {stats['exact']}、改動 {stats['changed']}、新增 {stats['new']} 段；"
+                          f"實際翻譯 {stats['translated_chars']}/{total} 字元")
+            write_from_index(index, args.out, bilingual=args.bilingual)
+        report_backend(backend)
+        print(f"✅ 完成：{args.out}（索引：{args.index}）")
+        return
+
     # 1) 讀 PDF -> 段落
-    raw_paragraphs = extract_paragraphs_from_pdf(args.pdf, use_ocr=args.ocr)
+    raw_paragraphs = extract_paragraphs_from_pdf(args.pdf, use_ocr=args.ocr, ocr=ocr)
     print(f'raw_paragraphs: {raw_paragraphs}')
     # 2) 先把段落合併為適中大小批次，且對每批做數學式 mask
-    batches = split_for_translation(raw_paragraphs, max_chars=600)  # 降低批次大小
+    backend = build_backend(cfg)
+    # 有翻譯記憶時每段各自成批：多段併批的話，插入一段就會讓後面所有批次的邊界位移，相同段落也對不上
+    batches = split_for_translation(raw_paragraphs, max_chars=backend.capabilities.max_chars, pack=not cfg.tm_path)
 
 
     masked_batches = []
     math_maps = []
     for b in batches:
-        masked, mp = mask_math(b)
+        masked, mp = mask_for_translation(b, cfg)
         masked_batches.append(masked)
         math_maps.append(mp)
 
-    # 3) 翻譯
-    backend = build_backend(cfg)
-    translated_batches = backend.translate_list(masked_batches, cfg)
-
-    # 4) 還原數學式
-    restored = [unmask_math(tb, mp) for tb, mp in zip(translated_batches, math_maps)]
+    # 3) 翻譯 + 還原數學式 + opencc 簡轉繁（逐組進行，結果以 generator 往下游送）
+    paragraphs = iter_translated_paragraphs(masked_batches, math_maps, backend, cfg)
 
-    # 5) opencc 簡轉繁（若使用 OpenAI/DeepL 輸出常為簡體，可轉成台灣用語）
-    restored = maybe_opencc_to_tw(restored, cfg)
+    # 4) 使用 Gemini API 逐塊潤飾
+    paragraphs = refine_paragraphs_stream(paragraphs)
 
-    # 6) 拆回段落（以原先的空行切分）
-    out_paragraphs = []
-    for b in restored:
-        out_paragraphs.extend([p.strip() for p in re.split(r"\n\s*\n", b) if p.strip()])
+    # 5) Gemini 潤飾後再次進行簡轉繁處理（因為 Gemini 可能會輸出簡體中文）
+    paragraphs = iter_opencc_to_tw(paragraphs, cfg)
 
-    # 7) 寫出
+    # 6) 逐段寫出（定期 flush，可用 tail -f 觀察進度）
     meta = {"source_pdf": os.path.abspath(args.pdf)}
-    if args.out.lower().endswith(".md"):
-        write_markdown(out_paragraphs, args.out, meta=meta)
-    elif args.out.lower().endswith(".docx"):
-        write_docx(out_paragraphs, args.out)
-    else:
-        raise ValueError("輸出副檔名需為 .md 或 .docx")
-
-
-    # 8) 使用 Gemini API 進行內容潤飾
-    with open(args.out, "r", encoding="utf-8") as f:
-        data = f.read()
-
-    data = gemini_refine(data)
-
-    # 9) Gemini 潤飾後再次進行簡轉繁處理（因為 Gemini 可能會輸出簡體中文）
-    if cfg.use_opencc:
-        try:
-            import opencc
-            conv = opencc.OpenCC(cfg.opencc_config)
-            data = conv.convert(data)
-            print("✅ 已完成 Gemini 潤飾後的簡轉繁處理")
-        except Exception as e:
-            print(f"警告：Gemini 潤飾後的簡轉繁處理失敗：{e}", file=sys.stderr)
-
-    with open(args.out, "w", encoding="utf-8") as f:
-        f.write(data)
-
+    with open_writer(args.out, meta=meta) as writer:
+        for p in paragraphs:
+            writer.write(p)
 
+    report_backend(backend)
     print(f"✅ 完成：{args.out}")
 
 if __name__ == "__main__":
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+translation_memory.py
+---------------------
+本機翻譯記憶（TM）與術語表：
+- 術語表：把 "envy-freeness"、"maximin share" 等術語換成 placeholder（同 mask_math 的做法），
+  翻譯後還原成指定譯名，跨段落、跨論文用詞一致
+- 翻譯記憶：以 SQLite 存放翻過的段落；完全相同的段落直接查 hash，
+  近似段落以 MinHash（one-permutation hashing）+ LSH 分段找候選，超過門檻且只差在數字時才沿用（換掉數字），不呼叫模型
+- 數學式/術語 placeholder 先正規化成 <<P0>>、<<P1>>…，同一句話換了公式也能命中
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import sqlite3
+import struct
+import zlib
+from array import array
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+PLACEHOLDER_RE = re.compile(r"<<[A-Z_]+_\d{5}>>")
+CANON_RE = re.compile(r"<<P(\d+)>>")
+NUMBER_RE = re.compile(r"(?<!\w)\d+(?:\.\d+)?")
+
+# ---------------------------
+# 術語表
+# ---------------------------
+
+class Glossary:
+    """
+    術語 -> 指定譯名。檔案格式：
+    - .json：{"envy-freeness": "無嫉妒性", ...}
+    - 其他：每行「術語<TAB>譯名」，# 開頭為註解
+    比對不分大小寫，且只比對完整詞（前後不能緊接字母數字）。
+    """
+    def __init__(self, terms: Dict[str, str]):
+        self.terms = {k.lower(): v for k, v in terms.items() if k.strip()}
+        alternation = "|".join(re.escape(t) for t in sorted(self.terms, key=len, reverse=True))
+        self.pattern = re.compile(rf"(?<!\w)(?:{alternation})(?!\w)", re.IGNORECASE) if self.terms else None
+
+    @classmethod
+    def load(cls, path: str) -> "Glossary":
+        with open(path, "r", encoding="utf-8") as f:
+            if path.lower().endswith(".json"):
+                return cls(json.load(f))
+            terms: Dict[str, str] = {}
+            for line in f:
+                line = line.rstrip("\n")
+                if not line.strip() or line.lstrip().startswith("#"):
+                    continue
+                if "\t" not in line:
+                    raise ValueError(f"術語表格式錯誤（需以 TAB 分隔）：{line!r}")
+                term, target = line.split("\t", 1)
+                terms[term.strip()] = target.strip()
+            return cls(terms)
+
+    def mask(self, text: str) -> Tuple[str, Dict[str, str]]:
+        """
+        把術語替換成唯一 placeholder；mapping 的值是「譯名」，
+        所以翻譯後用 unmask_math 還原時會直接換成指定譯名。
+        """
+        mapping: Dict[str, str] = {}
+        if self.pattern is None:
+            return text, mapping
+        counter = 0
+        def repl(match):
+            nonlocal counter
+            counter += 1
+            key = f"<<TERM_{counter:05d}>>"
+            mapping[key] = self.terms[match.group(0).lower()]
+            return key
+        return self.pattern.sub(repl, text), mapping
+
+# ---------------------------
+# placeholder 正規化
+# ---------------------------
+
+def canonicalize(text: str) -> Tuple[str, List[str]]:
+    """依出現順序把 placeholder 換成 <<P0>>、<<P1>>…，回傳 (正規化文字, 原 placeholder 列表)。"""
+    seen: Dict[str, int] = {}
+    def repl(match):
+        key = match.group(0)
+        if key not in seen:
+            seen[key] = len(seen)
+        return f"<<P{seen[key]}>>"
+    canon = PLACEHOLDER_RE.sub(repl, text)
+    return canon, list(seen)
+
+def decanonicalize(text: str, placeholders: List[str]) -> str:
+    def repl(match):
+        i = int(match.group(1))
+        return placeholders[i] if i < len(placeholders) else match.group(0)
+    return CANON_RE.sub(repl, text)
+
+def normalize_for_match(canon: str) -> str:
+    return re.sub(r"\s+", " ", canon).strip().lower()
+
+def adapt_numbers(new_source: str, old_source: str, old_translation: str) -> Optional[str]:
+    """
+    新舊原文只差在數字時（例如「Theorem 3」vs「Theorem 4」），把譯文裡對應的數字換掉。
+    其他差異無法安全調整，回傳 None。
+    """
+    if NUMBER_RE.sub("#", new_source) != NUMBER_RE.sub("#", old_source):
+        return None
+    out = old_translation
+    for old, new in zip(NUMBER_RE.findall(old_source), NUMBER_RE.findall(new_source)):
+        if old == new:
+            continue
+        if len(re.findall(rf"(?<![\d.]){re.escape(old)}(?![\d.])", out)) != 1:
+            return None
+        out = re.sub(rf"(?<![\d.]){re.escape(old)}(?![\d.])", new, out)
+    return out
+
+# ---------------------------
+# MinHash（one-permutation hashing）
+# ---------------------------
+
+def minhash_signature(text: str, num_bins: int=64, shingle: int=5) -> List[int]:
+    """
+    每個字元 shingle 只算一次 crc32，依 hash 值分到 num_bins 個桶、各取最小值（OPH），
+    空桶向右借用最近的非空桶（densification）。成本與文字長度成線性，不必算 num_bins 次 hash。
+    """
+    if len(text) < shingle:
+        return []
+    mins = [0xFFFFFFFF] * num_bins
+    seen = set()
+    for i in range(len(text) - shingle + 1):
+        sh = text[i:i + shingle]
+        if sh in seen:
+            continue
+        seen.add(sh)
+        h = zlib.crc32(sh.encode("utf-8"))
+        b = h % num_bins
+        v = h // num_bins
+        if v < mins[b]:
+            mins[b] = v
+    filled = [i for i, v in enumerate(mins) if v != 0xFFFFFFFF]
+    if not filled:
+        return []
+    for i in range(num_bins):
+        if mins[i] == 0xFFFFFFFF:
+            j = next((k for k in filled if k > i), filled[0])
+            mins[i] = mins[j] + (j - i) % num_bins  # 加上位移，避免借用的桶完全相同而高估相似度
+    return mins
+
+def jaccard_estimate(a: List[int], b: List[int]) -> float:
+    if not a or not b or len(a) != len(b):
+        return 0.0
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+def band_keys(sig: List[int], scope: str, bands: int) -> List[int]:
+    rows = len(sig) // bands
+    keys = []
+    for band in range(bands):
+        chunk = struct.pack(f"<{rows}I", *sig[band * rows:(band + 1) * rows])
+        digest = hashlib.blake2b(scope.encode("utf-8") + bytes([band]) + chunk, digest_size=8).digest()
+        keys.append(int.from_bytes(digest, "little", signed=True))
+    return keys
+
+# ---------------------------
+# 翻譯記憶
+# ---------------------------
+
+TM_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tm (
+    id          INTEGER PRIMARY KEY,
+    scope       TEXT NOT NULL,  -- 後端 + 模型 + 語言對；不同設定的譯文互不沿用
+    src_hash    TEXT NOT NULL,
+    source      TEXT NOT NULL,
+    translation TEXT NOT NULL,
+    sig         BLOB
+);
+CREATE UNIQUE INDEX IF NOT EXISTS tm_src ON tm (scope, src_hash);
+CREATE TABLE IF NOT EXISTS tm_bands (
+    band_key INTEGER NOT NULL,
+    tm_id    INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tm_bands_key ON tm_bands (band_key);
+"""
+
+
+@dataclass
+class TMHit:
+    translation: str
+    similarity: float
+    kind: str  # exact | fuzzy
+
+
+class TranslationMemory:
+    """
+    以 SQLite 存放 (原文, 譯文, MinHash 簽章)；LSH 的每個 band 存成一列有索引的 band_key，
+    查詢時一次 IN (...) 取出候選，不需要把整個記憶載入記憶體，數十萬段仍維持次毫秒級查詢。
+    """
+    def __init__(self, path: str, threshold: float=0.95, num_bins: int=64, bands: int=16,
+                 max_candidates: int=32):
+        self.path = path
+        self.threshold = threshold
+        self.num_bins = num_bins
+        self.bands = bands
+        self.max_candidates = max_candidates
+        self.conn = sqlite3.connect(path)
+        cols = {r[1] for r in self.conn.execute("PRAGMA table_info(tm)")}
+        if "tgt_lang" in cols:
+            # 舊版只以目標語言分區；改名後舊紀錄的 scope 不會與任何新設定相符，不會被誤用
+            self.conn.execute("ALTER TABLE tm RENAME COLUMN tgt_lang TO scope")
+        self.conn.executescript(TM_SCHEMA)
+
+    @staticmethod
+    def _hash(norm: str) -> str:
+        return hashlib.sha1(norm.encode("utf-8")).hexdigest()
+
+    def lookup(self, source: str, scope: str) -> Optional[TMHit]:
+        canon, placeholders = canonicalize(source)
+        norm = normalize_for_match(canon)
+        row = self.conn.execute(
+            "SELECT translation FROM tm WHERE scope = ? AND src_hash = ?", (scope, self._hash(norm))
+        ).fetchone()
+        if row:
+            return TMHit(decanonicalize(row[0], placeholders), 1.0, "exact")
+
+        sig = minhash_signature(norm, self.num_bins)
+        if not sig:
+            return None
+        keys = band_keys(sig, scope, self.bands)
+        # 命中 band 數越多越可能相似，只取前 max_candidates 名再比對簽章
+        rows = self.conn.execute(
+            f"SELECT tm.source, tm.translation, tm.sig FROM tm JOIN "
+            f"(SELECT tm_id, COUNT(*) AS hits FROM tm_bands WHERE band_key IN ({','.join('?' * len(keys))}) "
+            f"GROUP BY tm_id ORDER BY hits DESC LIMIT ?) AS c ON tm.id = c.tm_id",
+            (*keys, self.max_candidates),
+        ).fetchall()
+        scored = sorted(
+            ((jaccard_estimate(sig, array("I", old_sig).tolist()), old_source, old_translation)
+             for old_source, old_translation, old_sig in rows),
+            reverse=True,
+        )
+        for sim, old_source, old_translation in scored:
+            if sim < self.threshold:
+                break
+            # 只接受「只差在數字」的近似段落（例如 Theorem 3 vs Theorem 4），把譯文裡的數字換掉；
+            # 其他差異即使相似度很高也可能是否定、條件改變，原樣沿用會譯錯，交給模型重翻。
+            # placeholder 數量不同時舊譯文會留下還原不了的 <<Pn>>，同樣不沿用
+            if len(set(CANON_RE.findall(old_source))) != len(placeholders):
+                continue
+            adapted = adapt_numbers(canon, old_source, old_translation)
+            if adapted is not None:
+                return TMHit(decanonicalize(adapted, placeholders), sim, "fuzzy")
+        return None
+
+    def add_many(self, pairs: Iterable[Tuple[str, str]], scope: str):
+        with self.conn:
+            for source, translation in pairs:
+                canon, placeholders = canonicalize(source)
+                # 譯文裡的 placeholder 依原文的對應關係一起正規化
+                index = {p: i for i, p in enumerate(placeholders)}
+                canon_tr = PLACEHOLDER_RE.sub(
+                    lambda m: f"<<P{index[m.group(0)]}>>" if m.group(0) in index else m.group(0), translation
+                )
+                norm = normalize_for_match(canon)
+                sig = minhash_signature(norm, self.num_bins)
+                cur = self.conn.execute(
+                    "INSERT OR IGNORE INTO tm (scope, src_hash, source, translation, sig) VALUES (?, ?, ?, ?, ?)",
+                    (scope, self._hash(norm), canon, canon_tr, array("I", sig).tobytes() if sig else None),
+                )
+                if cur.rowcount and sig:
+                    self.conn.executemany(
+                        "INSERT INTO tm_bands (band_key, tm_id) VALUES (?, ?)",
+                        [(k, cur.lastrowid) for k in band_keys(sig, scope, self.bands)],
+                    )
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM tm").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()